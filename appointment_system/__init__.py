@@ -1,5 +1,15 @@
 from .database import Database
-from .models import User, Booking
-from .tools import AppointmentTools
-from .chatbot import Chatbot
+from .models import User, Booking, Resource, ToolResult
+from .inventory import SlotInventory
+from .cache import ToolCache
+from .holds import HoldReaper
+from .schedule import ScheduleRules, Schedule, DEFAULT_RULES
+from .tools import AppointmentTools, TOOLS
+from .ratelimit import RateLimiter, TokenBucket
+from .chatbot import Chatbot, AsyncChatbot
+from .memory import ConversationMemory, message_text
+from .sessions import Session, SessionStore, SQLiteSessionStore
+from .router import IntentRouter
+from .tracing import Tracer, tracer
+from .app import App, get_app
 from .utils import validate_user_data
\ No newline at end of file
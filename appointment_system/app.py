@@ -0,0 +1,57 @@
+import threading
+from .chatbot import Chatbot
+from .database import Database
+from .ratelimit import RateLimiter
+from .router import IntentRouter
+from .schedule import DEFAULT_RULES
+from .sessions import SQLiteSessionStore
+from .tools import AppointmentTools, TOOLS
+
+DEFAULT_MODEL = "claude-3-5-sonnet-20240620"
+
+
+class App:
+    """Everything that should exist once per process and be shared by all sessions.
+
+    Building it opens the connection pool, runs the migrations, loads the slot
+    inventory, starts the hold reaper and creates the Anthropic client (whose
+    HTTP connection pool is then kept alive across requests). Per-session state
+    goes through `sessions`, so any worker can serve any conversation.
+    """
+
+    def __init__(self, db_name='appointments.db', api_key="", model_name=DEFAULT_MODEL, rules=DEFAULT_RULES,
+                 pool_size=5, client=None, sessions=None, limiter=None):
+        self.db = Database(db_name, pool_size=pool_size)
+        self.sessions = sessions or SQLiteSessionStore(self.db)
+        self.appointment_tools = AppointmentTools(self.db, rules=rules)
+        # The anthropic package is only imported here, on first construction.
+        self.chatbot = Chatbot(
+            api_key=api_key,
+            model_name=model_name,
+            tools=TOOLS,
+            db=self.db,
+            appointment_tools=self.appointment_tools,
+            router=IntentRouter(),
+            client=client,
+            # One limiter per process, so every session draws on the same budget.
+            limiter=limiter or RateLimiter(),
+        )
+
+    def close(self):
+        self.appointment_tools.reaper.stop()
+        self.chatbot.executor.shutdown(wait=True)
+        self.db.close()
+
+
+_app = None
+_app_lock = threading.Lock()
+
+
+def get_app(**kwargs):
+    # Process-wide App; the arguments only matter for the first call.
+    global _app
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                _app = App(**kwargs)
+    return _app
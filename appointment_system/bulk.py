@@ -0,0 +1,305 @@
+"""Bulk import and export of users and bookings as CSV or JSONL.
+
+    python -m appointment_system.bulk import users users.csv
+    python -m appointment_system.bulk import bookings bookings.jsonl --chunk-size 10000
+    python -m appointment_system.bulk export bookings bookings.csv
+
+Files are streamed, never loaded whole. Rows are validated and written a chunk
+at a time, each chunk with one executemany inside one transaction. Once all
+bookings are in, slot availability is rebuilt from them with two set-based
+statements instead of a claim per booking.
+"""
+import argparse
+import csv
+import datetime
+import itertools
+import json
+import re
+import sys
+import time
+from .database import Database
+from .utils import as_text, validate_user_data
+
+USER_FIELDS = ("user_id", "name", "email", "phone_number", "age", "appointment_status")
+BOOKING_FIELDS = ("booking_id", "user_id", "resource_id", "date", "time", "status", "expires_at")
+BOOKING_STATUSES = frozenset({"pending", "confirmed"})
+TIME_PATTERN = re.compile(r'^([01]\d|2[0-3]):[0-5]\d$')
+# Same fresh hold that schema version 4 gave pending bookings without an expiry.
+IMPORTED_HOLD_SECONDS = 900
+MAX_REPORTED_ERRORS = 100
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.skipped = 0
+        self.invalid = 0
+        self.errors = []
+
+    def reject(self, line, errors):
+        self.invalid += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, errors))
+
+    def as_dict(self):
+        return {"rows": self.rows, "imported": self.imported, "skipped": self.skipped,
+                "invalid": self.invalid, "errors": self.errors}
+
+
+def _format(path, format=None):
+    if format:
+        return format
+    return "jsonl" if str(path).endswith((".jsonl", ".ndjson")) else "csv"
+
+
+def read_rows(path, format=None, report=None):
+    # Yields (line number, dict) pairs. A JSONL line that is not a JSON object
+    # is rejected through `report`, or raises ValueError without one.
+    with open(path, newline="", encoding="utf-8") as f:
+        if _format(path, format) == "jsonl":
+            for line, text in enumerate(f, start=1):
+                if not text.strip():
+                    continue
+                try:
+                    row = json.loads(text)
+                    if not isinstance(row, dict):
+                        raise ValueError("Row must be a JSON object.")
+                except ValueError as exc:
+                    if report is None:
+                        raise
+                    report.rows += 1
+                    report.reject(line, {"row": str(exc)})
+                    continue
+                yield line, row
+        else:
+            # Line numbers count the header as line 1.
+            yield from enumerate(csv.DictReader(f), start=2)
+
+
+def write_rows(path, fields, rows, format=None):
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        if _format(path, format) == "jsonl":
+            for row in rows:
+                f.write(json.dumps(dict(zip(fields, row)), separators=(",", ":")) + "\n")
+                count += 1
+        else:
+            writer = csv.writer(f)
+            writer.writerow(fields)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+    return count
+
+
+def _chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _blank(value):
+    return value is None or value == ""
+
+
+def _int(value):
+    if isinstance(value, bool):
+        raise ValueError(value)
+    return None if _blank(value) else int(value)
+
+
+def import_users(db: Database, path, format=None, chunk_size=5000):
+    report = ImportReport()
+    for chunk in _chunks(read_rows(path, format, report), chunk_size):
+        batch = []
+        for line, row in chunk:
+            report.rows += 1
+            # Scalars are validated and stored as text, so a phone number that
+            # JSON gives as a number is kept as its digits.
+            user = {field: as_text(row.get(field)) for field in ("name", "email", "phone_number")}
+            user["age"] = row.get("age")
+            errors = validate_user_data(user)
+            try:
+                user_id = _int(row.get("user_id"))
+            except (TypeError, ValueError):
+                errors["user_id"] = "User id must be a number."
+            if errors:
+                report.reject(line, errors)
+                continue
+            batch.append((user_id, user["name"], user["email"], user["phone_number"], int(user["age"]),
+                          as_text(row.get("appointment_status")) or "available"))
+        if batch:
+            # (email, phone_number) is unique; rows for existing users are skipped.
+            inserted = db.executemany('''INSERT OR IGNORE INTO users
+                                         (user_id, name, email, phone_number, age, appointment_status)
+                                         VALUES (?, ?, ?, ?, ?, ?)''', batch).rowcount
+            report.imported += inserted
+            report.skipped += len(batch) - inserted
+    return report
+
+
+def _booking(row, now):
+    errors = {}
+    values = {}
+    for field in ("booking_id", "user_id", "resource_id"):
+        try:
+            values[field] = _int(row.get(field))
+        except (TypeError, ValueError):
+            errors[field] = f"{field} must be a number."
+    if values.get("user_id") is None and "user_id" not in errors:
+        errors["user_id"] = "user_id is required."
+    if values.get("resource_id") is None:
+        values["resource_id"] = 1
+    elif values["resource_id"] < 1:
+        errors["resource_id"] = "resource_id must be a positive number."
+    try:
+        values["date"] = datetime.date.fromisoformat(as_text(row.get("date"))).isoformat()
+    except ValueError:
+        errors["date"] = "Date must be YYYY-MM-DD."
+    values["time"] = as_text(row.get("time"))
+    if not TIME_PATTERN.match(values["time"]):
+        errors["time"] = "Time must be HH:MM."
+    values["status"] = as_text(row.get("status")) or "confirmed"
+    if values["status"] not in BOOKING_STATUSES:
+        errors["status"] = "Status must be pending or confirmed."
+    try:
+        values["expires_at"] = None if _blank(row.get("expires_at")) else float(row["expires_at"])
+    except (TypeError, ValueError):
+        errors["expires_at"] = "expires_at must be a Unix timestamp."
+    if values["status"] == "pending" and values.get("expires_at") is None:
+        values["expires_at"] = now + IMPORTED_HOLD_SECONDS
+    elif values["status"] == "confirmed":
+        values["expires_at"] = None
+    return values, errors
+
+
+def _existing(db, table, column, ids, group=1000):
+    # Which of `ids` have a row in `table`, looked up in groups like _booked.
+    found = set()
+    for part in _chunks(ids, group):
+        found.update(value for (value,) in db.fetchall(
+            f'''SELECT {column} FROM {table} WHERE {column} IN ({",".join("?" * len(part))})''', part))
+    return found
+
+
+def _booked(db, slots, group=1000):
+    # Which of `slots` already have a booking; grouped to stay under SQLite's
+    # limit on bound parameters. A join, because `(...) IN (VALUES ...)` scans
+    # the whole index instead of searching it.
+    slots = list(slots)
+    booked = set()
+    for i in range(0, len(slots), group):
+        part = slots[i:i + group]
+        booked.update(db.fetchall(f'''SELECT b.resource_id, b.date, b.time
+                                      FROM (VALUES {",".join(["(?, ?, ?)"] * len(part))}) AS v
+                                      JOIN bookings b ON b.resource_id = v.column1
+                                                     AND b.date = v.column2 AND b.time = v.column3''',
+                                  tuple(value for slot in part for value in slot)))
+    return booked
+
+
+def import_bookings(db: Database, path, format=None, chunk_size=5000, rebuild=True):
+    report = ImportReport()
+    now = time.time()
+    # Slots taken by this import, so two rows for the same slot are caught even
+    # when they land in different chunks.
+    taken = set()
+    for chunk in _chunks(read_rows(path, format, report), chunk_size):
+        rows = []
+        for line, row in chunk:
+            report.rows += 1
+            values, errors = _booking(row, now)
+            if errors:
+                report.reject(line, errors)
+            else:
+                rows.append((line, values))
+        if not rows:
+            continue
+
+        known = _existing(db, "users", "user_id", {values["user_id"] for _, values in rows})
+        # Slots are kept per resource as bitmask bits, so a booking for a
+        # resource that does not exist must never reach rebuild_slots.
+        resources = _existing(db, "resources", "resource_id", {values["resource_id"] for _, values in rows})
+        booked = _booked(db, {(values["resource_id"], values["date"], values["time"]) for _, values in rows})
+
+        batch = []
+        for line, values in rows:
+            slot = (values["resource_id"], values["date"], values["time"])
+            if values["user_id"] not in known:
+                report.reject(line, {"user_id": f"Unknown user {values['user_id']}."})
+            elif values["resource_id"] not in resources:
+                report.reject(line, {"resource_id": f"Unknown resource {values['resource_id']}."})
+            elif slot in booked or slot in taken:
+                report.reject(line, {"slot": f"{values['date']} {values['time']} is already booked."})
+            else:
+                taken.add(slot)
+                batch.append(tuple(values[field] for field in BOOKING_FIELDS))
+        if batch:
+            # A booking_id that already exists is skipped rather than overwritten.
+            inserted = db.executemany(f'''INSERT OR IGNORE INTO bookings ({", ".join(BOOKING_FIELDS)})
+                                          VALUES ({", ".join("?" * len(BOOKING_FIELDS))})''', batch).rowcount
+            report.imported += inserted
+            report.skipped += len(batch) - inserted
+    if rebuild and report.imported:
+        rebuild_slots(db)
+    return report
+
+
+def rebuild_slots(db: Database):
+    # Every booked (resource, date, time) gets a slot, and every slot is free
+    # exactly when no booking points at it. The version triggers fire for the
+    # rows that change, so running processes pick this up on their next refresh.
+    with db.transaction():
+        db.execute('''INSERT OR IGNORE INTO slots (resource_id, date, time)
+                      SELECT DISTINCT resource_id, date, time FROM bookings''')
+        db.execute('''UPDATE slots SET available = NOT EXISTS (
+                          SELECT 1 FROM bookings b
+                          WHERE b.resource_id = slots.resource_id AND b.date = slots.date AND b.time = slots.time)''')
+
+
+def _export(db, query, fields, path, format):
+    # Rows are written as the cursor produces them rather than fetched all at once.
+    with db.connection() as conn:
+        return write_rows(path, fields, conn.execute(query), format)
+
+
+def export_users(db: Database, path, format=None):
+    return _export(db, f'''SELECT {", ".join(USER_FIELDS)} FROM users ORDER BY user_id''', USER_FIELDS, path, format)
+
+
+def export_bookings(db: Database, path, format=None):
+    return _export(db, f'''SELECT {", ".join(BOOKING_FIELDS)} FROM bookings ORDER BY booking_id''',
+                   BOOKING_FIELDS, path, format)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=("import", "export"))
+    parser.add_argument("kind", choices=("users", "bookings"))
+    parser.add_argument("path")
+    parser.add_argument("--db", default="appointments.db")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="default: from the file extension")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    db = Database(args.db)
+    start = time.perf_counter()
+    if args.command == "export":
+        export = export_users if args.kind == "users" else export_bookings
+        result = {"exported": export(db, args.path, args.format)}
+    elif args.kind == "users":
+        result = import_users(db, args.path, args.format, args.chunk_size).as_dict()
+    else:
+        result = import_bookings(db, args.path, args.format, args.chunk_size).as_dict()
+    result["elapsed_s"] = time.perf_counter() - start
+    db.close()
+    json.dump(result, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import OrderedDict
+from .tracing import tracer
+
+# Tag for entries that depend on every date (e.g. the list of open dates).
+ALL_DATES = object()
+
+
+class ToolCache:
+    """LRU + TTL cache for the ToolResults of read-only tools.
+
+    A result keeps its JSON once serialized, so a hit costs no encoding either.
+
+    Entries are tagged with the dates they were computed from, so a write can
+    drop exactly the entries it made stale.
+    """
+
+    def __init__(self, max_entries=1024, ttl=60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.tags = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                tracer.count("appointment_tool_cache_lookups_total", result="hit")
+                return entry[0]
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            tracer.count("appointment_tool_cache_lookups_total", result="miss")
+            return None
+
+    def put(self, key, value, dates):
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (value, time.monotonic() + self.ttl, dates)
+            for date in dates:
+                self.tags.setdefault(date, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, dates):
+        if not dates:
+            return
+        with self.lock:
+            stale = set(self.tags.get(ALL_DATES, ()))
+            for date in dates:
+                stale.update(self.tags.get(date, ()))
+            for key in stale:
+                self._drop(key)
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tags.clear()
+
+    def _drop(self, key):
+        _, _, dates = self.entries.pop(key)
+        for date in dates:
+            keys = self.tags.get(date)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[date]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -1,79 +1,363 @@
+import asyncio
+import contextvars
 import json
-import anthropic
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .memory import PARAGRAPH, estimate_tokens, message_text
+from .models import ToolResult
+from .tool_schemas import dispatch_table
+from .tracing import NOOP_SPAN, tracer
+
+SYSTEM_PROMPT = """You are an appointment booking chatbot. You can only assist users with tasks related to appointment bookings, such as selecting appointment dates, time slots, creating or canceling bookings, and confirming or changing appointments.
+            Start with a greeting, then ask for the user's preferred appointment date and then slots in respective selected dates.
+            For changing bookings, always ask for the new date first, then provide available time slots for that date.
+            If no slots are available for a date, inform the user and suggest they choose another date.
+            Always confirm the final booking details with the user before making any changes.
+            If a user asks a question unrelated to appointment bookings, politely inform them that you can only assist with appointment-related queries and guide them to booking-related tasks."""
+
+# Tools that only read state; consecutive calls to these can run concurrently.
+READ_ONLY_TOOLS = frozenset({"select_appointment_date", "select_time_slot", "lookup_user", "next_available_slots",
+                             "list_resources"})
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+USAGE_FIELDS = ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens")
+
+MAX_TOKENS = 1000
+
+FALLBACK_REPLY = "Sorry, I couldn't complete that request. Could you try again?"
 
 class Chatbot:
-    def __init__(self, api_key, model_name, tools, db, appointment_tools):
-        self.client = anthropic.Anthropic(api_key=api_key)
+    def __init__(self, api_key, model_name, tools, db, appointment_tools, max_tool_iterations=5, executor=None,
+                 router=None, client=None, limiter=None):
+        self.limiter = limiter
+        self.client = client if client is not None else self._create_client(api_key)
         self.model_name = model_name
         self.tools = tools
         self.db = db
         self.appointment_tools = appointment_tools
+        # Tool name -> handler, built once from the AppointmentTools method signatures.
+        self.handlers = dispatch_table(appointment_tools) if appointment_tools is not None else {}
+        self.max_tool_iterations = max_tool_iterations
+        self.executor = executor or ThreadPoolExecutor(max_workers=8)
+        self.router = router
+        # Cache breakpoints: the tool definitions and the system prompt never change,
+        # so every request after the first reads them from the prompt cache.
+        self.cached_tools = [*tools[:-1], {**tools[-1], "cache_control": CACHE_CONTROL}] if tools else []
+        self.system = [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": CACHE_CONTROL}]
+        self.prompt_tokens = estimate_tokens(json.dumps([self.system, self.cached_tools]))
+        self.usage = dict.fromkeys(USAGE_FIELDS, 0)
+        self.usage_lock = threading.Lock()
+
+    def _create_client(self, api_key):
+        import anthropic
+        # With a limiter, retries are its job; the SDK's own would bypass the queue.
+        if self.limiter is not None:
+            return anthropic.Anthropic(api_key=api_key, max_retries=0)
+        return anthropic.Anthropic(api_key=api_key)
+
+    def _request(self, messages):
+        system = self.system
+        # A ConversationMemory carries a summary of the turns it compacted away; it
+        # goes after the cached system prompt so the prompt itself stays cached.
+        summary = getattr(messages, "summary", "")
+        if summary:
+            system = [*system, {"type": "text", "text": summary}]
+        return dict(model=self.model_name, max_tokens=MAX_TOKENS, tools=self.cached_tools, system=system,
+                    messages=self._with_cache_breakpoint(messages))
+
+    def _model_span(self):
+        return tracer.span("model.call", "appointment_model_call_seconds", model=self.model_name)
+
+    def _estimate_tokens(self, messages):
+        # What the limiter reserves up front: prompt, history and a full-length reply.
+        history = getattr(messages, "tokens", None)
+        if history is None:
+            history = sum(estimate_tokens(message["content"]) for message in messages)
+        return self.prompt_tokens + estimate_tokens(getattr(messages, "summary", "")) + history + MAX_TOKENS
+
+    def _create(self, messages):
+        request = self._request(messages)
+        with self._model_span() as span:
+            if self.limiter is None:
+                response = self.client.messages.create(**request)
+            else:
+                response = self.limiter.call(lambda: self.client.messages.create(**request),
+                                             self._estimate_tokens(messages))
+            self._record_usage(response, span)
+        return response
+
+    def _stream(self, messages):
+        request = self._request(messages)
+        if self.limiter is None:
+            return self.client.messages.stream(**request)
+        return self.limiter.stream(lambda: self.client.messages.stream(**request), self._estimate_tokens(messages))
+
+    def _with_cache_breakpoint(self, messages):
+        # Mark the end of the conversation so far, so the next request (the tool
+        # follow-up or the next turn) reuses the whole prefix. Only the copy sent
+        # to the API is marked; the stored history is left untouched.
+        if not messages:
+            return list(messages)
+        last = messages[-1]
+        content = last["content"]
+        if isinstance(content, str):
+            blocks = [{"type": "text", "text": content}]
+        else:
+            blocks = [block if isinstance(block, dict) else block.model_dump() for block in content]
+        if not blocks:
+            return list(messages)
+        blocks[-1] = {**blocks[-1], "cache_control": CACHE_CONTROL}
+        return [*messages[:-1], {**last, "content": blocks}]
+
+    def _record_usage(self, response, span=NOOP_SPAN):
+        usage = {field: getattr(response.usage, field, None) or 0 for field in USAGE_FIELDS}
+        with self.usage_lock:
+            for field, tokens in usage.items():
+                self.usage[field] += tokens
+        span.set(stop_reason=response.stop_reason, **usage)
+        for field, tokens in usage.items():
+            tracer.count("appointment_model_tokens_total", tokens, type=field)
+        return usage
+
+    def cache_stats(self):
+        with self.usage_lock:
+            usage = dict(self.usage)
+        prompt_tokens = usage["input_tokens"] + usage["cache_creation_input_tokens"] + usage["cache_read_input_tokens"]
+        usage["cache_hit_rate"] = usage["cache_read_input_tokens"] / prompt_tokens if prompt_tokens else 0.0
+        return usage
 
     def process_tool_call(self, tool_name, tool_input, user_id=None):
-        if tool_name == "create_booking":
-            return self.appointment_tools.create_booking(tool_input['date'], tool_input['time'], user_id)
-        elif tool_name == "cancel_booking":
-            return self.appointment_tools.cancel_booking(tool_input['booking_id'])
-        elif tool_name == "confirm_booking":
-            return self.appointment_tools.confirm_booking(tool_input['booking_id'], tool_input['date'], tool_input['time'])
-        elif tool_name == "lookup_user":
-            return self.appointment_tools.lookup_user(tool_input['name'], tool_input['email'], tool_input['phone_number'])
-        elif tool_name == "select_appointment_date":
-            return self.appointment_tools.select_appointment_date()
-        elif tool_name == "select_time_slot":
-            return self.appointment_tools.select_time_slot(tool_input['date'])
-        elif tool_name == "change_booking_date":
-            return self.appointment_tools.change_booking_date(tool_input['booking_id'], tool_input['new_date'])
-        elif tool_name == "change_booking_time":
-            return self.appointment_tools.change_booking_time(tool_input['booking_id'], tool_input['new_time'])
+        handler = self.handlers.get(tool_name)
+        if handler is None:
+            # Raised, so _run_tool reports it with is_error set like any other failure.
+            raise ValueError(f"Unknown tool {tool_name}")
+        return handler(tool_input, user_id)
+
+    def _run_tool(self, tool_calls, user_id):
+        tool_error = False
+
+        try:
+            with tracer.span("tool.call", "appointment_tool_call_seconds", tool=tool_calls.name):
+                tool_result = self.process_tool_call(tool_calls.name, tool_calls.input, user_id)
+        except Exception as e:
+            tool_result = ToolResult.error(str(e))
+            tool_error = True
+            tracer.count("appointment_tool_errors_total", tool=tool_calls.name)
+
+        # The history holds what goes over the wire, so this is the one place a
+        # result is serialized.
+        return {
+            "type": "tool_result",
+            "tool_use_id": tool_calls.id,
+            "content": tool_result.to_json(),
+            "is_error": tool_error
+        }
+
+    def _tool_batches(self, tool_calls):
+        # Consecutive read-only calls form one batch; anything that writes runs on its own, in order.
+        batch = []
+        for tool_call in tool_calls:
+            if tool_call.name in READ_ONLY_TOOLS:
+                batch.append(tool_call)
+                continue
+            if batch:
+                yield batch
+                batch = []
+            yield [tool_call]
+        if batch:
+            yield batch
+
+    def _run_tools(self, response, user_id):
+        tool_calls = [block for block in response.content if block.type == "tool_use"]
+        results = []
+        for batch in self._tool_batches(tool_calls):
+            if len(batch) == 1:
+                results.append(self._run_tool(batch[0], user_id))
+            else:
+                # Each call runs in a copy of this context so its spans nest under the current turn.
+                contexts = [contextvars.copy_context() for _ in batch]
+                results.extend(self.executor.map(
+                    lambda context, tool_call: context.run(self._run_tool, tool_call, user_id), contexts, batch
+                ))
+        return results
+
+    def _route(self, user_message, user_id, messages):
+        route = self.router.match(user_message) if self.router else None
+        if route is None:
+            return None
+        try:
+            tool_result = self.process_tool_call(route.tool_name, route.tool_input, user_id)
+        except Exception:
+            return None
+        reply = self.router.render(route, tool_result)
+        if reply is not None:
+            messages.extend(self.router.transcript(route, tool_result, reply))
+            tracer.count("appointment_routed_turns_total", intent=route.intent)
+        return reply
+
+    def _finish(self, response, messages):
+        text = "".join(block.text for block in response.content if block.type == "text") or FALLBACK_REPLY
+        messages.append({"role": "assistant", "content": text})
+        return text
 
     def chat(self, user_message, user_id, messages):
-        response = self.client.messages.create(
-            model=self.model_name,
-            max_tokens=1000,
-            tools=self.tools,
-            system="""You are an appointment booking chatbot. You can only assist users with tasks related to appointment bookings, such as selecting appointment dates, time slots, creating or canceling bookings, and confirming or changing appointments. 
-            Start with a greeting, then ask for the user's preferred appointment date and then slots in respective selected dates. 
-            For changing bookings, always ask for the new date first, then provide available time slots for that date. 
-            If no slots are available for a date, inform the user and suggest they choose another date. 
-            Always confirm the final booking details with the user before making any changes.
-            If a user asks a question unrelated to appointment bookings, politely inform them that you can only assist with appointment-related queries and guide them to booking-related tasks.""",
-            messages=messages
-        )
+        with tracer.span("chat.turn", "appointment_turn_seconds", mode="chat"):
+            return self._chat(user_message, user_id, messages)
+
+    def _chat(self, user_message, user_id, messages):
+        reply = self._route(user_message, user_id, messages)
+        if reply is not None:
+            return reply
+
+        response = self._create(messages)
+
+        for _ in range(self.max_tool_iterations):
+            if response.stop_reason != "tool_use":
+                break
+            messages.append({"role": "assistant", "content": response.content})
+            messages.append({"role": "user", "content": self._run_tools(response, user_id)})
+            response = self._create(messages)
+
+        return self._finish(response, messages)
+
+    def chat_stream(self, user_message, user_id, messages):
+        """Same turn as `chat`, but yields text deltas as the model produces them."""
+        with tracer.span("chat.turn", "appointment_turn_seconds", mode="stream"):
+            yield from self._chat_stream(user_message, user_id, messages)
+
+    def _chat_stream(self, user_message, user_id, messages):
+        reply = self._route(user_message, user_id, messages)
+        if reply is not None:
+            yield reply
+            return
+
+        with self._model_span() as span, self._stream(messages) as stream:
+            yield from stream.text_stream
+            response = stream.get_final_message()
+            self._record_usage(response, span)
+
+        spoke = False
+        for _ in range(self.max_tool_iterations):
+            if response.stop_reason != "tool_use":
+                break
+            # Text from the next model call starts a new paragraph instead of
+            # running on from what was said before the tool calls.
+            spoke = spoke or bool(message_text(response.content))
+            separator = PARAGRAPH if spoke else ""
+            messages.append({"role": "assistant", "content": response.content})
+            messages.append({"role": "user", "content": self._run_tools(response, user_id)})
+            with self._model_span() as span, self._stream(messages) as stream:
+                for text in stream.text_stream:
+                    if text:
+                        yield separator + text
+                        separator = ""
+                response = stream.get_final_message()
+                self._record_usage(response, span)
+
+        self._finish(response, messages)
+
+class AsyncChatbot(Chatbot):
+    """Chatbot whose `chat` is a coroutine, so one event loop can serve many conversations.
+
+    Model calls go through `anthropic.AsyncAnthropic`; tool calls (which hit the
+    database) run on `executor` so they never block the loop.
+    """
+
+    def _create_client(self, api_key):
+        import anthropic
+        if self.limiter is not None:
+            return anthropic.AsyncAnthropic(api_key=api_key, max_retries=0)
+        return anthropic.AsyncAnthropic(api_key=api_key)
+
+    async def _create(self, messages):
+        request = self._request(messages)
+        with self._model_span() as span:
+            if self.limiter is None:
+                response = await self.client.messages.create(**request)
+            else:
+                response = await self.limiter.acall(lambda: self.client.messages.create(**request),
+                                                    self._estimate_tokens(messages))
+            self._record_usage(response, span)
+        return response
+
+    def _stream(self, messages):
+        request = self._request(messages)
+        if self.limiter is None:
+            return self.client.messages.stream(**request)
+        return self.limiter.astream(lambda: self.client.messages.stream(**request), self._estimate_tokens(messages))
+
+    async def _run_tools(self, response, user_id):
+        tool_calls = [block for block in response.content if block.type == "tool_use"]
+        loop = asyncio.get_running_loop()
+        results = []
+        for batch in self._tool_batches(tool_calls):
+            results.extend(await asyncio.gather(
+                *(loop.run_in_executor(self.executor, contextvars.copy_context().run, self._run_tool, tool_call, user_id)
+                  for tool_call in batch)
+            ))
+        return results
+
+    async def _route_async(self, user_message, user_id, messages):
+        if self.router is None:
+            return None
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, contextvars.copy_context().run, self._route,
+                                          user_message, user_id, messages)
+
+    async def chat(self, user_message, user_id, messages):
+        with tracer.span("chat.turn", "appointment_turn_seconds", mode="chat"):
+            return await self._chat(user_message, user_id, messages)
+
+    async def _chat(self, user_message, user_id, messages):
+        reply = await self._route_async(user_message, user_id, messages)
+        if reply is not None:
+            return reply
+
+        response = await self._create(messages)
+
+        for _ in range(self.max_tool_iterations):
+            if response.stop_reason != "tool_use":
+                break
+            messages.append({"role": "assistant", "content": response.content})
+            messages.append({"role": "user", "content": await self._run_tools(response, user_id)})
+            response = await self._create(messages)
+
+        return self._finish(response, messages)
+
+    async def chat_stream(self, user_message, user_id, messages):
+        with tracer.span("chat.turn", "appointment_turn_seconds", mode="stream"):
+            async for text in self._chat_stream(user_message, user_id, messages):
+                yield text
+
+    async def _chat_stream(self, user_message, user_id, messages):
+        reply = await self._route_async(user_message, user_id, messages)
+        if reply is not None:
+            yield reply
+            return
 
-        if response.stop_reason == "tool_use":
+        with self._model_span() as span:
+            async with self._stream(messages) as stream:
+                async for text in stream.text_stream:
+                    yield text
+                response = await stream.get_final_message()
+            self._record_usage(response, span)
 
+        spoke = False
+        for _ in range(self.max_tool_iterations):
+            if response.stop_reason != "tool_use":
+                break
+            spoke = spoke or bool(message_text(response.content))
+            separator = PARAGRAPH if spoke else ""
             messages.append({"role": "assistant", "content": response.content})
+            messages.append({"role": "user", "content": await self._run_tools(response, user_id)})
+            with self._model_span() as span:
+                async with self._stream(messages) as stream:
+                    async for text in stream.text_stream:
+                        if text:
+                            yield separator + text
+                            separator = ""
+                    response = await stream.get_final_message()
+                self._record_usage(response, span)
 
-            tool_calls = response.content[1]
-            tool_name = tool_calls.name
-            tool_input = json.loads(json.dumps(tool_calls.input))
-            tool_error = False
-
-            try:
-                tool_result = self.process_tool_call(tool_name, tool_input, user_id)
-            except Exception as e:
-                tool_result = json.dumps({"status": "error", "message": str(e)})
-                tool_error = True
-
-            messages.append({
-                "role": "user",
-                "content": [
-                    {
-                        "type": "tool_result",
-                        "tool_use_id": tool_calls.id,
-                        "content": tool_result,
-                        "is_error": tool_error
-                    }
-                ]
-            })
-
-            response = self.client.messages.create(
-                model=self.model_name,
-                max_tokens=1000,
-                tools=self.tools,
-                messages=messages
-            )
-
-        messages.append({"role": "assistant", "content": response.content[0].text})
-        return response.content[0].text
+        self._finish(response, messages)
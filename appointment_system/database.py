@@ -1,46 +1,278 @@
+import queue
 import sqlite3
 import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from .tracing import NOOP_SPAN, tracer
+
+Result = namedtuple('Result', ['rows', 'lastrowid', 'rowcount'])
+
+# Each entry is one schema version. Never edit an entry that has shipped; append a new one.
+MIGRATIONS = [
+    # 1: initial schema. Uses IF NOT EXISTS so databases created before
+    # versioning (user_version 0) upgrade cleanly.
+    [
+        '''CREATE TABLE IF NOT EXISTS users (
+                    user_id INTEGER PRIMARY KEY,
+                    name TEXT,
+                    email TEXT,
+                    phone_number TEXT,
+                    age INTEGER,
+                    appointment_status TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS bookings (
+                    booking_id INTEGER PRIMARY KEY,
+                    user_id INTEGER,
+                    date TEXT,
+                    time TEXT,
+                    status TEXT,
+                    FOREIGN KEY (user_id) REFERENCES users (user_id))''',
+        '''CREATE TABLE IF NOT EXISTS slots (
+                    slot_id INTEGER PRIMARY KEY,
+                    date TEXT NOT NULL,
+                    time TEXT NOT NULL,
+                    available INTEGER NOT NULL DEFAULT 1,
+                    version INTEGER NOT NULL DEFAULT 0)''',
+        '''CREATE UNIQUE INDEX IF NOT EXISTS idx_slots_date_time ON slots (date, time)''',
+        '''CREATE INDEX IF NOT EXISTS idx_slots_version ON slots (version)''',
+        # Every change to a slot stamps it with a new value of a global counter,
+        # so any process can pick up other processes' changes with one range scan.
+        '''CREATE TABLE IF NOT EXISTS slot_version (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    version INTEGER NOT NULL)''',
+        '''INSERT OR IGNORE INTO slot_version (id, version) VALUES (0, 0)''',
+        '''CREATE TRIGGER IF NOT EXISTS slots_stamp_insert AFTER INSERT ON slots
+                   BEGIN
+                       UPDATE slot_version SET version = version + 1;
+                       UPDATE slots SET version = (SELECT version FROM slot_version)
+                       WHERE slot_id = NEW.slot_id;
+                   END''',
+        '''CREATE TRIGGER IF NOT EXISTS slots_stamp_update AFTER UPDATE OF available ON slots
+                   WHEN OLD.available != NEW.available
+                   BEGIN
+                       UPDATE slot_version SET version = version + 1;
+                       UPDATE slots SET version = (SELECT version FROM slot_version)
+                       WHERE slot_id = NEW.slot_id;
+                   END''',
+    ],
+    # 2: indexes for user lookup and booking queries. Users sharing an email and
+    # phone number are merged into the oldest row before the unique index is built.
+    [
+        '''CREATE TEMP TABLE user_merge (old_id INTEGER PRIMARY KEY, new_id INTEGER NOT NULL)''',
+        '''INSERT INTO user_merge (old_id, new_id)
+           SELECT dup.user_id, keep.user_id
+           FROM users dup JOIN (SELECT MIN(user_id) AS user_id, email, phone_number FROM users
+                                WHERE email IS NOT NULL AND phone_number IS NOT NULL
+                                GROUP BY email, phone_number HAVING COUNT(*) > 1) keep
+           ON dup.email = keep.email AND dup.phone_number = keep.phone_number AND dup.user_id != keep.user_id''',
+        '''UPDATE bookings SET user_id = (SELECT new_id FROM user_merge WHERE old_id = bookings.user_id)
+           WHERE user_id IN (SELECT old_id FROM user_merge)''',
+        '''DELETE FROM users WHERE user_id IN (SELECT old_id FROM user_merge)''',
+        '''DROP TABLE user_merge''',
+        '''CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email_phone ON users (email, phone_number)''',
+        '''CREATE INDEX IF NOT EXISTS idx_bookings_date_time ON bookings (date, time)''',
+        '''CREATE INDEX IF NOT EXISTS idx_bookings_user_status ON bookings (user_id, status)''',
+    ],
+    # 3: resources (providers, rooms). Every slot and booking belongs to one;
+    # existing rows move to resource 1.
+    [
+        '''CREATE TABLE resources (
+                    resource_id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    kind TEXT NOT NULL DEFAULT 'provider')''',
+        '''INSERT INTO resources (resource_id, name) VALUES (1, 'Default')''',
+        '''ALTER TABLE slots ADD COLUMN resource_id INTEGER NOT NULL DEFAULT 1 REFERENCES resources (resource_id)''',
+        '''ALTER TABLE bookings ADD COLUMN resource_id INTEGER NOT NULL DEFAULT 1 REFERENCES resources (resource_id)''',
+        '''DROP INDEX idx_slots_date_time''',
+        '''CREATE UNIQUE INDEX idx_slots_resource_date_time ON slots (resource_id, date, time)''',
+        '''CREATE INDEX idx_bookings_resource_date_time ON bookings (resource_id, date, time)''',
+    ],
+    # 4: pending bookings are holds that expire. Holds that predate this get a
+    # fresh 15 minutes rather than being dropped mid-conversation.
+    [
+        '''ALTER TABLE bookings ADD COLUMN expires_at REAL''',
+        '''UPDATE bookings SET expires_at = CAST(strftime('%s', 'now') AS REAL) + 900 WHERE status = 'pending' ''',
+        '''CREATE INDEX idx_bookings_pending_expiry ON bookings (expires_at) WHERE status = 'pending' ''',
+    ],
+    # 5: conversations, so any worker can serve any session. Messages are
+    # append-only rows keyed by their position in the conversation.
+    [
+        '''CREATE TABLE sessions (
+                    session_id TEXT PRIMARY KEY,
+                    user_id INTEGER,
+                    state TEXT NOT NULL DEFAULT '{}',
+                    memory TEXT NOT NULL DEFAULT '{}',
+                    base_seq INTEGER NOT NULL DEFAULT 0,
+                    next_seq INTEGER NOT NULL DEFAULT 0,
+                    revision INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL)''',
+        '''CREATE TABLE session_messages (
+                    session_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    PRIMARY KEY (session_id, seq)) WITHOUT ROWID''',
+    ],
+    # 6: slots used to be added as free even when a booking already pointed at
+    # them; mark every slot free exactly when no booking does.
+    [
+        '''UPDATE slots SET available = NOT EXISTS (
+                    SELECT 1 FROM bookings b
+                    WHERE b.resource_id = slots.resource_id AND b.date = slots.date AND b.time = slots.time)''',
+    ],
+    # 7: a user's conversations are found by user, so signing in again resumes them.
+    [
+        '''CREATE INDEX IF NOT EXISTS idx_sessions_user_updated ON sessions (user_id, updated_at)''',
+    ],
+]
+
+def _query_span(query):
+    if not tracer.enabled:
+        return NOOP_SPAN
+    return tracer.span("db.query", "appointment_db_query_seconds", statement=query.split(None, 1)[0].upper())
 
 class Database:
-    def __init__(self, db_name='appointments.db'):
-        self.conn = sqlite3.connect(db_name, check_same_thread=False)
-        self.cursor = self.conn.cursor()
-        self.lock = threading.Lock()
+    def __init__(self, db_name='appointments.db', pool_size=5, timeout=30.0):
+        self.db_name = db_name
+        self.timeout = timeout
+        # Every connection to ':memory:' opens a separate database, so it cannot be pooled.
+        self.pool_size = 1 if db_name == ':memory:' else pool_size
+        self.pool = queue.LifoQueue(maxsize=self.pool_size)
+        self.local = threading.local()
+        for _ in range(self.pool_size):
+            self.pool.put(self._connect())
         self._create_tables()
 
+    def _connect(self):
+        conn = sqlite3.connect(self.db_name, timeout=self.timeout, check_same_thread=False,
+                               isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        # Calls made while a thread already holds a connection (e.g. inside a
+        # transaction) reuse it instead of checking out a second one.
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+        start = time.perf_counter()
+        try:
+            conn = self.pool.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No database connection available after {self.timeout}s")
+        tracer.observe("appointment_db_pool_wait_seconds", time.perf_counter() - start)
+        self.local.conn = conn
+        try:
+            yield conn
+        finally:
+            self.local.conn = None
+            self.pool.put(conn)
+
+    @contextmanager
+    def transaction(self):
+        with self.connection() as conn:
+            if conn.in_transaction:
+                yield conn
+                return
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+
+    @contextmanager
+    def snapshot(self):
+        # A read transaction: every query inside sees the database as of the
+        # first one, even if other connections commit in between.
+        with self.connection() as conn:
+            if conn.in_transaction:
+                yield conn
+                return
+            conn.execute('BEGIN')
+            try:
+                yield conn
+            finally:
+                conn.rollback()
+
     def _create_tables(self):
-        with self.lock:
-            self.cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-                                    user_id INTEGER PRIMARY KEY,
-                                    name TEXT,
-                                    email TEXT,
-                                    phone_number TEXT,
-                                    age INTEGER,
-                                    appointment_status TEXT)''')
-            
-            self.cursor.execute('''CREATE TABLE IF NOT EXISTS bookings (
-                                    booking_id INTEGER PRIMARY KEY,
-                                    user_id INTEGER,
-                                    date TEXT,
-                                    time TEXT,
-                                    status TEXT,
-                                    FOREIGN KEY (user_id) REFERENCES users (user_id))''')
-            self.conn.commit()
-
-    def execute(self, query, params=None):
-        with self.lock:
-            if params:
-                return self.cursor.execute(query, params)
-            return self.cursor.execute(query)
-
-    def fetchone(self):
-        return self.cursor.fetchone()
-
-    def fetchall(self):
-        return self.cursor.fetchall()
-
-    def commit(self):
-        self.conn.commit()
+        # Migrations run in order inside one transaction; PRAGMA user_version
+        # records how many have been applied, so each runs once per database.
+        with self.transaction() as conn:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f'PRAGMA user_version = {number}')
+
+    def execute(self, query, params=(), row_factory=None):
+        # `row_factory` (e.g. Booking.from_row) builds each row in place of a tuple.
+        with self.connection() as conn, _query_span(query):
+            cursor = conn.execute(query, params)
+            cursor.row_factory = row_factory
+            return Result(cursor.fetchall(), cursor.lastrowid, cursor.rowcount)
+
+    def executemany(self, query, seq_of_params):
+        with self.transaction() as conn, _query_span(query):
+            cursor = conn.executemany(query, seq_of_params)
+            return Result([], cursor.lastrowid, cursor.rowcount)
+
+    def fetchone(self, query, params=(), row_factory=None):
+        rows = self.execute(query, params, row_factory).rows
+        return rows[0] if rows else None
+
+    def fetchall(self, query, params=(), row_factory=None):
+        return self.execute(query, params, row_factory).rows
+
+    def add_resource(self, name, kind='provider'):
+        return self.execute('''INSERT INTO resources (name, kind) VALUES (?, ?)''', (name, kind)).lastrowid
+
+    def add_slots(self, slots):
+        # `slots` yields (resource_id, date, time) tuples. A new slot starts out
+        # taken if a booking already points at it.
+        self.executemany('''INSERT OR IGNORE INTO slots (resource_id, date, time, available)
+                            SELECT ?1, ?2, ?3, NOT EXISTS (SELECT 1 FROM bookings
+                                                           WHERE resource_id=?1 AND date=?2 AND time=?3)''', slots)
+
+    def claim_slot(self, date, time, resource_id=1):
+        return self.execute('''UPDATE slots SET available=0
+                               WHERE resource_id=? AND date=? AND time=? AND available=1''',
+                            (resource_id, date, time)).rowcount == 1
+
+    def release_slot(self, date, time, resource_id=1):
+        # A slot is only handed back once no booking row still points at it.
+        return self.execute('''UPDATE slots SET available=1
+                               WHERE resource_id=? AND date=? AND time=? AND available=0
+                               AND NOT EXISTS (SELECT 1 FROM bookings WHERE resource_id=? AND date=? AND time=?)''',
+                            (resource_id, date, time, resource_id, date, time)).rowcount == 1
+
+    def expire_holds(self, now):
+        # Drops every pending booking whose hold ran out and frees its slot, in
+        # one transaction; the partial index keeps this a range scan over holds.
+        with self.transaction():
+            expired = self.fetchall('''SELECT booking_id, resource_id, date, time FROM bookings
+                                       WHERE status = 'pending' AND expires_at <= ?''', (now,))
+            if expired:
+                self.executemany('''DELETE FROM bookings WHERE booking_id=?''',
+                                 [(booking_id,) for booking_id, _, _, _ in expired])
+                self.executemany('''UPDATE slots SET available=1
+                                    WHERE resource_id=? AND date=? AND time=? AND available=0
+                                    AND NOT EXISTS (SELECT 1 FROM bookings WHERE resource_id=? AND date=? AND time=?)''',
+                                 [(resource_id, date, time, resource_id, date, time)
+                                  for _, resource_id, date, time in expired])
+        return expired
+
+    def slot_changes(self, since):
+        return self.fetchall('''SELECT resource_id, date, time, available, version FROM slots
+                                WHERE version > ? ORDER BY version''', (since,))
 
     def close(self):
-        self.conn.close()
\ No newline at end of file
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                break
@@ -0,0 +1,84 @@
+import heapq
+import threading
+import time
+from .database import Database
+from .inventory import SlotInventory
+from .tracing import tracer
+
+
+class HoldReaper:
+    """Background thread that releases pending bookings once their hold expires.
+
+    Expiry times go on a min-heap, so the thread sleeps exactly until the next
+    hold is due instead of polling. When it wakes it expires every overdue hold
+    in one range query (whichever process created them), then refreshes the
+    inventory. `sweep_interval` bounds the sleep, which picks up holds created by
+    other processes that exited before reaping them. AppointmentTools starts it
+    on construction, and the first reap runs straight away.
+    """
+
+    def __init__(self, db: Database, inventory: SlotInventory, sweep_interval=300.0, clock=time.time):
+        self.db = db
+        self.inventory = inventory
+        self.sweep_interval = sweep_interval
+        self.clock = clock
+        self.heap = []
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopped = False
+        self.expired = 0
+
+    def add(self, expires_at):
+        with self.condition:
+            heapq.heappush(self.heap, expires_at)
+            tracer.gauge("appointment_holds_scheduled", len(self.heap))
+            if self.thread is None:
+                self.start()
+            elif self.heap[0] == expires_at:
+                self.condition.notify()
+
+    def start(self):
+        with self.condition:
+            if self.thread is None:
+                self.stopped = False
+                self.thread = threading.Thread(target=self._run, name="hold-reaper", daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            thread, self.thread = self.thread, None
+            self.condition.notify()
+        if thread is not None:
+            thread.join()
+
+    def reap(self):
+        now = self.clock()
+        with self.condition:
+            while self.heap and self.heap[0] <= now:
+                heapq.heappop(self.heap)
+            tracer.gauge("appointment_holds_scheduled", len(self.heap))
+        expired = self.db.expire_holds(now)
+        if expired:
+            self.expired += len(expired)
+            tracer.count("appointment_holds_expired_total", len(expired))
+            self.inventory.refresh()
+        return expired
+
+    def _run(self):
+        # Holds left behind by an earlier run (or another process) are handled
+        # by the first reap.
+        while True:
+            try:
+                self.reap()
+            except Exception:
+                tracer.count("appointment_hold_reaper_errors_total")
+            with self.condition:
+                if self.stopped:
+                    return
+                timeout = self.sweep_interval
+                if self.heap:
+                    timeout = min(timeout, max(0.0, self.heap[0] - self.clock()))
+                self.condition.wait(timeout)
+                if self.stopped:
+                    return
@@ -0,0 +1,115 @@
+import threading
+from .database import Database
+
+# Resource mask that selects every resource (-1 has all bits set).
+ALL_RESOURCES = -1
+
+
+def resource_mask(resource_ids=None):
+    if resource_ids is None:
+        return ALL_RESOURCES
+    if isinstance(resource_ids, int):
+        return 1 << resource_ids
+    mask = 0
+    for resource_id in resource_ids:
+        mask |= 1 << resource_id
+    return mask
+
+
+def resource_ids_of(mask):
+    found = []
+    while mask:
+        low = mask & -mask
+        found.append(low.bit_length() - 1)
+        mask ^= low
+    return found
+
+
+class SlotInventory:
+    """In-memory view of the `slots` table.
+
+    Each date keeps its times in sorted order and, per time, two integer
+    bitmasks indexed by resource_id: which resources have a slot there and which
+    of those are still free. Cross-resource questions ("is anyone free at 10:00",
+    "which providers are free that day") are then a few big-integer operations per
+    time instead of a loop over resources. The view is kept in sync with the
+    database (and therefore with other processes) by replaying only the rows whose
+    version is newer than the last one seen.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.lock = threading.Lock()
+        self.version = 0
+        self.times = {}
+        self.slots = {}
+        self.free = {}
+        # Called with the set of dates that changed, whoever changed them.
+        self.listeners = []
+        self.refresh()
+
+    def add_slots(self, slots, resource_ids=(1,)):
+        self.db.add_slots([(resource_id, date, time) for resource_id in resource_ids
+                           for date, times in slots.items() for time in times])
+        self.refresh()
+
+    def refresh(self):
+        rows = self.db.slot_changes(self.version)
+        changed = set()
+        if not rows:
+            return changed
+        with self.lock:
+            for resource_id, date, time, available, version in rows:
+                if version <= self.version:
+                    continue
+                self._apply(resource_id, date, time, available)
+                self.version = version
+                changed.add(date)
+        for listener in self.listeners:
+            listener(changed)
+        return changed
+
+    def _apply(self, resource_id, date, time, available):
+        slots = self.slots.setdefault(date, {})
+        free = self.free.setdefault(date, {})
+        bit = 1 << resource_id
+        if time not in slots:
+            slots[time] = 0
+            free[time] = 0
+            times = self.times.setdefault(date, [])
+            times.append(time)
+            times.sort()
+        slots[time] |= bit
+        if available:
+            free[time] |= bit
+        else:
+            free[time] &= ~bit
+
+    def is_available(self, date, time, resource_ids=None):
+        self.refresh()
+        return bool(self.free.get(date, {}).get(time, 0) & resource_mask(resource_ids))
+
+    def free_resources(self, date, time=None, resource_ids=None):
+        # Resources with a free slot at `time`, or at any time that day.
+        self.refresh()
+        free = self.free.get(date, {})
+        if time is not None:
+            mask = free.get(time, 0)
+        else:
+            mask = 0
+            for bits in free.values():
+                mask |= bits
+        return resource_ids_of(mask & resource_mask(resource_ids))
+
+    def available_times(self, date, resource_ids=None):
+        self.refresh()
+        mask = resource_mask(resource_ids)
+        free = self.free.get(date)
+        if not free:
+            return []
+        return [time for time in self.times[date] if free[time] & mask]
+
+    def available_dates(self, resource_ids=None):
+        self.refresh()
+        mask = resource_mask(resource_ids)
+        return sorted(date for date, free in self.free.items() if any(bits & mask for bits in free.values()))
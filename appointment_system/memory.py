@@ -0,0 +1,164 @@
+import json
+import re
+
+DATE_PATTERN = re.compile(r'\b\d{4}-\d{2}-\d{2}\b')
+
+
+def _as_dict(block):
+    return block if isinstance(block, dict) else block.model_dump()
+
+
+# Joins the text of the model calls in one turn, as streamed and as replayed.
+PARAGRAPH = "\n\n"
+
+
+def message_text(content):
+    # What a reader sees of a message: its text, without tool calls or results.
+    if isinstance(content, str):
+        return content
+    return PARAGRAPH.join(block["text"] for block in map(_as_dict, content)
+                          if block.get("type") == "text" and block.get("text"))
+
+
+def estimate_tokens(content):
+    # Roughly four characters per token; good enough to keep a budget, and cheap.
+    if isinstance(content, str):
+        return len(content) // 4 + 1
+    return len(json.dumps([_as_dict(block) for block in content], default=str)) // 4 + 1
+
+
+class ConversationMemory(list):
+    """Message history that stays within a token budget.
+
+    It is a drop-in replacement for the plain list `Chatbot.chat` appends to. Token
+    counts are kept per message as they are appended; once `max_tokens` is exceeded
+    the oldest turns (a turn starts at a user text message, so tool_use/tool_result
+    pairs never get split) are dropped and folded into `summary`, keeping at least
+    the last `keep_turns` turns. The summary records the bookings that are still
+    live and the dates that were discussed, and is sent along with the system prompt.
+    """
+
+    def __init__(self, messages=(), max_tokens=8000, keep_turns=4, count_tokens=estimate_tokens, summarize=None):
+        super().__init__()
+        self.max_tokens = max_tokens
+        self.keep_turns = keep_turns
+        self.count_tokens = count_tokens
+        self.summarize = summarize
+        self.costs = []
+        self.tokens = 0
+        self.summary = ""
+        self.bookings = {}
+        self.dates = []
+        self.requests = []
+        self.compactions = 0
+        # Messages removed from the front so far; message i was the
+        # (dropped + i)-th message ever appended.
+        self.dropped = 0
+        self.extend(messages)
+
+    def append(self, message):
+        super().append(message)
+        cost = self.count_tokens(message["content"])
+        self.costs.append(cost)
+        self.tokens += cost
+        if self.tokens > self.max_tokens:
+            self.compact()
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def _turn_starts(self):
+        return [i for i, message in enumerate(self) if message["role"] == "user" and isinstance(message["content"], str)]
+
+    def compact(self):
+        starts = self._turn_starts()
+        if len(starts) < 2:
+            return
+        # Keep the newest keep_turns turns, fewer if that is still over budget,
+        # but never drop the turn in progress.
+        keep = min(self.keep_turns, len(starts) - 1)
+        cut = starts[-keep] if keep else starts[-1]
+        while keep > 1 and self.tokens - sum(self.costs[:cut]) > self.max_tokens:
+            keep -= 1
+            cut = starts[-keep]
+
+        dropped = self[:cut]
+        self._remember(dropped)
+        if self.summarize:
+            self.summary = self.summarize(self.summary, dropped)
+        else:
+            self.summary = self._summary()
+
+        self.tokens -= sum(self.costs[:cut])
+        del self.costs[:cut]
+        del self[:cut]
+        self.dropped += cut
+        self.compactions += 1
+
+    def summary_state(self):
+        # Everything compaction folded away, in a JSON-friendly form.
+        return {
+            "summary": self.summary,
+            "bookings": [[booking_id, booking] for booking_id, booking in self.bookings.items()],
+            "dates": self.dates,
+            "requests": self.requests,
+            "compactions": self.compactions,
+            "dropped": self.dropped,
+        }
+
+    def restore_summary_state(self, state):
+        self.summary = state.get("summary", "")
+        self.bookings = {booking_id: booking for booking_id, booking in state.get("bookings", ())}
+        self.dates = list(state.get("dates", ()))
+        self.requests = list(state.get("requests", ()))
+        self.compactions = state.get("compactions", 0)
+        self.dropped = state.get("dropped", 0)
+
+    def _remember(self, messages):
+        tool_uses = {}
+        for message in messages:
+            if isinstance(message["content"], str):
+                if message["role"] == "user":
+                    self.requests = (self.requests + [message["content"][:200]])[-3:]
+                    for date in DATE_PATTERN.findall(message["content"]):
+                        if date not in self.dates:
+                            self.dates.append(date)
+                continue
+            for block in map(_as_dict, message["content"]):
+                if block.get("type") == "tool_use":
+                    tool_uses[block["id"]] = (block["name"], block.get("input") or {})
+                elif block.get("type") == "tool_result" and block["tool_use_id"] in tool_uses:
+                    self._remember_tool(*tool_uses[block["tool_use_id"]], block.get("content"))
+
+    def _remember_tool(self, name, tool_input, content):
+        try:
+            result = json.loads(content) if isinstance(content, str) else {}
+        except ValueError:
+            return
+        if result.get("status") != "success":
+            return
+        booking_id = result.get("booking_id", tool_input.get("booking_id"))
+        if name == "create_booking":
+            self.bookings[booking_id] = {"date": tool_input.get("date"), "time": tool_input.get("time"), "status": "pending"}
+        elif booking_id in self.bookings:
+            booking = self.bookings[booking_id]
+            if name == "confirm_booking":
+                booking["status"] = "confirmed"
+            elif name == "cancel_booking":
+                del self.bookings[booking_id]
+            elif name == "change_booking_date":
+                booking["date"] = tool_input.get("new_date")
+                booking["time"] = tool_input.get("new_time") or booking["time"]
+            elif name == "change_booking_time":
+                booking["time"] = tool_input.get("new_time")
+
+    def _summary(self):
+        lines = ["Summary of the earlier part of this conversation:"]
+        for booking_id, booking in self.bookings.items():
+            lines.append(f"- Booking {booking_id}: {booking['date']} at {booking['time']} ({booking['status']})")
+        if self.dates:
+            lines.append(f"- Dates discussed: {', '.join(self.dates[-10:])}")
+        for request in self.requests:
+            lines.append(f"- The user asked: {request}")
+        return "\n".join(lines)
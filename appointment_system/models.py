@@ -1,14 +1,100 @@
-class User:
-    def __init__(self, name, email, phone_number, age, appointment_status='available'):
+import json
+
+
+class Model:
+    # Plain records with __slots__. `from_row` is an sqlite3 row factory: columns
+    # are matched to fields by name, and fields the query did not select are None.
+    __slots__ = ()
+
+    @classmethod
+    def from_row(cls, cursor, row):
+        record = cls.__new__(cls)
+        values = {column[0]: value for column, value in zip(cursor.description, row)}
+        for name in cls.__slots__:
+            setattr(record, name, values.get(name))
+        return record
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class User(Model):
+    __slots__ = ("name", "email", "phone_number", "age", "appointment_status", "user_id")
+
+    def __init__(self, name, email, phone_number, age, appointment_status='available', user_id=None):
         self.name = name
         self.email = email
         self.phone_number = phone_number
         self.age = age
         self.appointment_status = appointment_status
+        self.user_id = user_id
+
+
+class Booking(Model):
+    __slots__ = ("user_id", "date", "time", "status", "resource_id", "expires_at", "booking_id")
 
-class Booking:
-    def __init__(self, user_id, date, time, status='pending'):
+    def __init__(self, user_id, date, time, status='pending', resource_id=1, expires_at=None, booking_id=None):
         self.user_id = user_id
         self.date = date
         self.time = time
-        self.status = status
\ No newline at end of file
+        self.status = status
+        self.resource_id = resource_id
+        self.expires_at = expires_at
+        self.booking_id = booking_id
+
+
+class Resource(Model):
+    __slots__ = ("resource_id", "name", "kind")
+
+    def __init__(self, resource_id, name, kind='provider'):
+        self.resource_id = resource_id
+        self.name = name
+        self.kind = kind
+
+
+class ToolResult:
+    """What an AppointmentTools method returns.
+
+    Callers in the process (the router, the UI) read fields directly; the JSON
+    sent to the model is built on first use of `to_json` and kept, so a result
+    served from the ToolCache is not serialized again.
+    """
+
+    __slots__ = ("fields", "_json")
+
+    def __init__(self, fields):
+        self.fields = fields
+        self._json = None
+
+    @classmethod
+    def success(cls, **fields):
+        return cls({"status": "success", **fields})
+
+    @classmethod
+    def error(cls, message):
+        return cls({"status": "error", "message": message})
+
+    @property
+    def ok(self):
+        return self.fields.get("status") != "error"
+
+    def get(self, key, default=None):
+        return self.fields.get(key, default)
+
+    def __getitem__(self, key):
+        return self.fields[key]
+
+    def __contains__(self, key):
+        return key in self.fields
+
+    def to_json(self):
+        if self._json is None:
+            self._json = json.dumps(self.fields)
+        return self._json
+
+    def __repr__(self):
+        return f"ToolResult({self.fields!r})"
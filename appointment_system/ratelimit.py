@@ -0,0 +1,228 @@
+import asyncio
+import random
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager, AsyncExitStack, ExitStack
+from .tracing import tracer
+
+# 429 is a rate limit, 529 means the API is overloaded; both are worth waiting out.
+RETRY_STATUSES = frozenset({429, 529})
+
+
+class TokenBucket:
+    """`rate` units per second, bursting up to `capacity`.
+
+    `reserve` always succeeds but may leave the bucket in debt; the caller then
+    sleeps for the returned number of seconds. Because later callers queue behind
+    that debt, waiting is first come, first served.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.level = capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        with self.lock:
+            self._refill()
+            self.level -= amount
+            return max(0.0, -self.level / self.rate)
+
+    def refund(self, amount):
+        # Negative amounts charge extra, e.g. when a call used more than reserved.
+        with self.lock:
+            self._refill()
+            self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """Client-side limits for model calls, shared by every Chatbot in the process.
+
+    Each call first reserves one request from the requests-per-minute bucket and
+    its estimated tokens from the tokens-per-minute bucket, sleeps off any debt,
+    then waits for one of `max_concurrency` slots. Once the response is in, the
+    token reservation is corrected to the tokens actually used (input, cache
+    writes and output; cache reads do not count against the API's limits). A 429
+    or 529 is retried up to `max_retries` times after an exponential backoff with
+    full jitter, or after the server's retry-after if that is longer.
+
+    Sync callers share the slots across threads; async callers share a separate
+    set of `max_concurrency` slots per event loop.
+    """
+
+    def __init__(self, requests_per_minute=50, tokens_per_minute=40_000, max_concurrency=8, max_retries=5,
+                 base_delay=0.5, max_delay=30.0, clock=time.monotonic, seed=None):
+        self.requests = TokenBucket(requests_per_minute / 60, requests_per_minute, clock)
+        self.tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute, clock)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.random = random.Random(seed)
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.async_slots = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.retries = 0
+
+    def _queued(self, change):
+        with self.lock:
+            self.waiting += change
+            tracer.gauge("appointment_model_queue_depth", self.waiting)
+
+    def _reserve(self, tokens):
+        return max(self.requests.reserve(1), self.tokens.reserve(tokens))
+
+    def _settle(self, tokens, response):
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        used = sum(getattr(usage, field, None) or 0
+                   for field in ("input_tokens", "cache_creation_input_tokens", "output_tokens"))
+        self.tokens.refund(tokens - used)
+
+    def _failed(self, tokens):
+        # A rejected request (429, 529, ...) used no tokens; give its reservation
+        # back so the retry and everyone else are not throttled for it.
+        self.tokens.refund(tokens)
+
+    def backoff(self, exc, attempt):
+        # Seconds to wait before retrying after `exc`, or None to give up.
+        status = getattr(exc, "status_code", None)
+        if status not in RETRY_STATUSES or attempt >= self.max_retries:
+            return None
+        delay = self.random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        response = getattr(exc, "response", None)
+        retry_after = getattr(response, "headers", {}).get("retry-after")
+        try:
+            delay = max(delay, float(retry_after))
+        except (TypeError, ValueError):
+            pass
+        with self.lock:
+            self.retries += 1
+        tracer.count("appointment_model_retries_total", status=status)
+        return delay
+
+    @contextmanager
+    def _slot(self, tokens):
+        start = time.perf_counter()
+        self._queued(1)
+        try:
+            time.sleep(self._reserve(tokens))
+            self.slots.acquire()
+        finally:
+            self._queued(-1)
+        tracer.observe("appointment_model_queue_seconds", time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            self.slots.release()
+
+    def call(self, fn, tokens):
+        attempt = 0
+        while True:
+            with self._slot(tokens):
+                try:
+                    response = fn()
+                except Exception as exc:
+                    self._failed(tokens)
+                    delay = self.backoff(exc, attempt)
+                    if delay is None:
+                        raise
+                else:
+                    self._settle(tokens, response)
+                    return response
+            attempt += 1
+            time.sleep(delay)
+
+    @contextmanager
+    def stream(self, open_stream, tokens):
+        # Only opening the stream is retried; once text has been yielded to the
+        # user a failure has to surface.
+        attempt = 0
+        while True:
+            with ExitStack() as stack:
+                stack.enter_context(self._slot(tokens))
+                try:
+                    stream = stack.enter_context(open_stream())
+                except Exception as exc:
+                    self._failed(tokens)
+                    delay = self.backoff(exc, attempt)
+                    if delay is None:
+                        raise
+                else:
+                    yield stream
+                    self._settle(tokens, stream.get_final_message())
+                    return
+            attempt += 1
+            time.sleep(delay)
+
+    def _async_slots(self):
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            slots = self.async_slots.get(loop)
+            if slots is None:
+                slots = self.async_slots[loop] = asyncio.BoundedSemaphore(self.max_concurrency)
+            return slots
+
+    @asynccontextmanager
+    async def _async_slot(self, tokens):
+        slots = self._async_slots()
+        start = time.perf_counter()
+        self._queued(1)
+        try:
+            await asyncio.sleep(self._reserve(tokens))
+            await slots.acquire()
+        finally:
+            self._queued(-1)
+        tracer.observe("appointment_model_queue_seconds", time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            slots.release()
+
+    async def acall(self, fn, tokens):
+        attempt = 0
+        while True:
+            async with self._async_slot(tokens):
+                try:
+                    response = await fn()
+                except Exception as exc:
+                    self._failed(tokens)
+                    delay = self.backoff(exc, attempt)
+                    if delay is None:
+                        raise
+                else:
+                    self._settle(tokens, response)
+                    return response
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def astream(self, open_stream, tokens):
+        attempt = 0
+        while True:
+            async with AsyncExitStack() as stack:
+                await stack.enter_async_context(self._async_slot(tokens))
+                try:
+                    stream = await stack.enter_async_context(open_stream())
+                except Exception as exc:
+                    self._failed(tokens)
+                    delay = self.backoff(exc, attempt)
+                    if delay is None:
+                        raise
+                else:
+                    yield stream
+                    self._settle(tokens, await stream.get_final_message())
+                    return
+            attempt += 1
+            await asyncio.sleep(delay)
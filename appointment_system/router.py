@@ -0,0 +1,79 @@
+import re
+import uuid
+from collections import namedtuple
+
+Route = namedtuple('Route', ['intent', 'tool_name', 'tool_input'])
+
+DATE = r'(\d{4}-\d{2}-\d{2})'
+
+# Each pattern has to match the whole message; anything looser goes to the model.
+PATTERNS = [
+    ("list_dates", "select_appointment_date", re.compile(
+        r'^(?:what|which)\s+(?:dates|days)\s+(?:are\s+)?(?:free|available|open)\??$'
+        r'|^(?:show\s+(?:me\s+)?)?(?:the\s+)?(?:free|available|open)\s+(?:dates|days)\??$', re.I)),
+    ("list_slots", "select_time_slot", re.compile(
+        r'^(?:(?:what|which|any)\s+)?(?:free\s+|available\s+|open\s+)?(?:time\s+)?(?:slots|times)\s+'
+        r'(?:are\s+)?(?:free\s+|available\s+|open\s+)?(?:on|for)\s+' + DATE + r'\??$', re.I)),
+    ("cancel", "cancel_booking", re.compile(
+        r'^(?:please\s+)?cancel\s+(?:my\s+)?booking\s+(?:id\s+)?#?(\d+)\.?$', re.I)),
+]
+
+
+class IntentRouter:
+    """Answers a few unambiguous requests without a model round-trip.
+
+    `match` only returns a route when a message matches one of the patterns in
+    full; `render` turns the tool result into a reply, or returns None when the
+    result is not one it has a template for, in which case the caller should fall
+    back to the model.
+    """
+
+    def __init__(self, patterns=PATTERNS):
+        self.patterns = patterns
+
+    def match(self, message):
+        text = " ".join(message.split())
+        for intent, tool_name, pattern in self.patterns:
+            found = pattern.match(text)
+            if found:
+                return Route(intent, tool_name, self._tool_input(intent, found))
+        return None
+
+    def _tool_input(self, intent, found):
+        if intent == "list_slots":
+            return {"date": found.group(1)}
+        if intent == "cancel":
+            return {"booking_id": int(found.group(1))}
+        return {}
+
+    def render(self, route, result):
+        # `result` is the ToolResult the tool returned.
+        if route.intent == "list_dates" and "available_dates" in result:
+            if not result["available_dates"]:
+                return "There are no dates with open slots at the moment."
+            return "These dates have open slots: " + ", ".join(result["available_dates"]) + ". Which one would you like?"
+        if route.intent == "list_slots":
+            if "available_time_slots" in result:
+                return (f"Available time slots on {route.tool_input['date']}: "
+                        + ", ".join(result["available_time_slots"]) + ". Which one would you like?")
+            if result.get("status") == "error":
+                return f"There are no available slots on {route.tool_input['date']}. Would you like to pick another date?"
+        if route.intent == "cancel" and result.get("status") in ("success", "error"):
+            if result["status"] == "success":
+                return f"Booking {route.tool_input['booking_id']} has been cancelled."
+            return f"I couldn't cancel booking {route.tool_input['booking_id']}: {result['message']}."
+        return None
+
+    @staticmethod
+    def transcript(route, tool_result, reply):
+        # The turns the model would have produced, so later turns have the context.
+        tool_use_id = f"toolu_router_{uuid.uuid4().hex[:24]}"
+        return [
+            {"role": "assistant", "content": [
+                {"type": "tool_use", "id": tool_use_id, "name": route.tool_name, "input": route.tool_input}
+            ]},
+            {"role": "user", "content": [
+                {"type": "tool_result", "tool_use_id": tool_use_id, "content": tool_result.to_json(), "is_error": False}
+            ]},
+            {"role": "assistant", "content": reply},
+        ]
@@ -0,0 +1,238 @@
+import bisect
+import datetime
+import functools
+import threading
+
+from .inventory import SlotInventory, resource_ids_of, resource_mask
+
+
+def _minutes(hhmm):
+    hours, minutes = hhmm.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def _hhmm(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def _day_start(date):
+    return date.toordinal() * 1440
+
+
+class ScheduleRules:
+    """Recurring opening hours that slots are generated from.
+
+    `weekly_hours` maps a weekday (0 = Monday) to a list of ("HH:MM", "HH:MM")
+    opening ranges. `breaks` are daily ranges during which no slot may start or
+    run. `holidays` are ISO dates that are closed, and `exceptions` maps ISO dates
+    to ranges that replace the weekly hours for that day (an empty list closes it).
+    """
+
+    def __init__(self, weekly_hours, slot_minutes=60, breaks=(), holidays=(), exceptions=None, horizon_days=30):
+        self.weekly_hours = {day: [(_minutes(start), _minutes(end)) for start, end in ranges]
+                             for day, ranges in weekly_hours.items()}
+        self.slot_minutes = slot_minutes
+        self.breaks = [(_minutes(start), _minutes(end)) for start, end in breaks]
+        self.holidays = frozenset(holidays)
+        self.exceptions = {date: [(_minutes(start), _minutes(end)) for start, end in ranges]
+                           for date, ranges in (exceptions or {}).items()}
+        self.horizon_days = horizon_days
+        self.times_for = functools.lru_cache(maxsize=4096)(self._times_for)
+
+    def _times_for(self, date):
+        iso = date.isoformat()
+        if iso in self.holidays:
+            return ()
+        ranges = self.exceptions.get(iso, self.weekly_hours.get(date.weekday(), ()))
+        times = []
+        for start, end in ranges:
+            for minute in range(start, end - self.slot_minutes + 1, self.slot_minutes):
+                if not any(low < minute + self.slot_minutes and minute < high for low, high in self.breaks):
+                    times.append(_hhmm(minute))
+        return tuple(times)
+
+
+# Weekdays 09:00-17:00 in one-hour slots with a lunch break.
+DEFAULT_RULES = ScheduleRules(
+    weekly_hours={day: [("09:00", "17:00")] for day in range(5)},
+    slot_minutes=60,
+    breaks=[("12:00", "13:00")],
+)
+
+
+class IntervalIndex:
+    """Sorted, non-overlapping [start, end) intervals in absolute minutes."""
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+
+    def __len__(self):
+        return len(self.starts)
+
+    def replace_range(self, low, high, intervals):
+        # Drop every interval starting in [low, high) and insert `intervals` instead.
+        i = bisect.bisect_left(self.starts, low)
+        j = bisect.bisect_left(self.starts, high)
+        intervals = sorted(intervals)
+        self.starts[i:j] = [start for start, _ in intervals]
+        self.ends[i:j] = [end for _, end in intervals]
+
+    def count(self, low, high):
+        return bisect.bisect_left(self.starts, high) - bisect.bisect_left(self.starts, low)
+
+    def overlaps(self, start, end):
+        i = bisect.bisect_left(self.starts, end) - 1
+        return i >= 0 and self.ends[i] > start
+
+
+class Schedule:
+    """Materializes rule-generated slots into the inventory one day at a time.
+
+    Days are only written to the `slots` table, for every resource, when they are
+    first queried or booked (`ensure`). Each resource's booked slots are mirrored
+    into its own IntervalIndex, so `next_available` for one resource can walk a
+    long horizon without touching the database: days that were never
+    materialized are free according to the rules, and fully booked days are
+    skipped with one range count. Searches across resources use the inventory's
+    per-time resource masks instead of visiting each resource.
+    """
+
+    def __init__(self, rules: ScheduleRules, inventory: SlotInventory, resource_ids=(1,), today=datetime.date.today):
+        self.rules = rules
+        self.inventory = inventory
+        self.resource_ids = list(resource_ids)
+        self.today = today
+        self.booked = {}
+        # date -> {time: mask of booked resources} as of the last reindex, so a
+        # change only rebuilds the indexes of resources whose bits flipped.
+        self.booked_masks = {}
+        self.lock = threading.Lock()
+        self.materialized = set()
+        inventory.listeners.append(self._reindex)
+        self._reindex(set(inventory.times))
+
+    def _reindex(self, dates):
+        duration = self.rules.slot_minutes
+        for iso in dates:
+            day = _day_start(datetime.date.fromisoformat(iso))
+            with self.lock:
+                # Read the inventory under the lock, so the last reindex to run
+                # always sees the newest state.
+                free = self.inventory.free.get(iso, {})
+                masks = {time: slots & ~free.get(time, 0) for time, slots in self.inventory.slots.get(iso, {}).items()}
+                previous = self.booked_masks.get(iso, {})
+                flipped = 0
+                for time in masks.keys() | previous.keys():
+                    flipped |= masks.get(time, 0) ^ previous.get(time, 0)
+                for resource_id in resource_ids_of(flipped):
+                    bit = 1 << resource_id
+                    booked = [(day + _minutes(time), day + _minutes(time) + duration)
+                              for time, mask in masks.items() if mask & bit]
+                    self.booked.setdefault(resource_id, IntervalIndex()).replace_range(day, day + 1440, booked)
+                self.booked_masks[iso] = masks
+
+    def add_resource(self, resource_id):
+        if resource_id in self.resource_ids:
+            return
+        self.resource_ids.append(resource_id)
+        # Days that already have slots are not materialized again, so the new
+        # resource gets its rule slots on each of them now.
+        backfill = {}
+        for iso in self.materialized | self.inventory.times.keys():
+            try:
+                times = self.rules.times_for(datetime.date.fromisoformat(iso))
+            except ValueError:
+                continue
+            if times:
+                backfill[iso] = times
+        if backfill:
+            self.inventory.add_slots(backfill, (resource_id,))
+
+    def bookable(self, date):
+        # Only today and the next horizon_days - 1 days can be booked.
+        return 0 <= (date - self.today()).days < self.rules.horizon_days
+
+    def ensure(self, iso):
+        """Materializes `iso` and returns True, or returns False if it cannot be booked.
+
+        Dates come from the model, so a past date or one beyond the horizon is
+        refused rather than written to `slots`.
+        """
+        try:
+            date = datetime.date.fromisoformat(iso)
+        except (TypeError, ValueError):
+            return False
+        if not self.bookable(date):
+            return False
+        if iso in self.materialized:
+            return True
+        if iso not in self.inventory.times:
+            times = self.rules.times_for(date)
+            if times:
+                self.inventory.add_slots({iso: times}, self.resource_ids)
+        self.materialized.add(iso)
+        return True
+
+    def times_for(self, date):
+        iso = date.isoformat()
+        if iso in self.inventory.times:
+            return self.inventory.times[iso]
+        return self.rules.times_for(date)
+
+    def _free_times(self, date, resource_ids):
+        # Free start times on `date` for one resource (via its interval index)
+        # or for any of several resources (via the inventory masks).
+        iso = date.isoformat()
+        single = isinstance(resource_ids, int)
+        mask = resource_mask(resource_ids)
+        if iso not in self.inventory.times:
+            if resource_ids is not None and not resource_mask(self.resource_ids) & mask:
+                return ()
+            times = self.rules.times_for(date)
+        elif not single:
+            free = self.inventory.free[iso]
+            return [time for time in self.inventory.times[iso] if free[time] & mask]
+        else:
+            slots = self.inventory.slots[iso]
+            times = [time for time in self.inventory.times[iso] if slots[time] & mask]
+        index = self.booked.get(resource_ids) if single else None
+        if index is None:
+            return times
+        day = _day_start(date)
+        if index.count(day, day + 1440) >= len(times):
+            return ()
+        duration = self.rules.slot_minutes
+        return [time for time in times
+                if not index.overlaps(day + _minutes(time), day + _minutes(time) + duration)]
+
+    def available_dates(self, start=None, days=None, resource_ids=None):
+        start = start or self.today()
+        found = []
+        with self.lock:
+            for offset in range(self.rules.horizon_days if days is None else days):
+                date = start + datetime.timedelta(days=offset)
+                if self._free_times(date, resource_ids):
+                    found.append(date.isoformat())
+        return found
+
+    def next_available(self, after=None, count=5, days=365, resource_ids=None):
+        after = after or datetime.datetime.now()
+        # Nothing before today is bookable, so a search from the past starts today.
+        after = max(after, datetime.datetime.combine(self.today(), datetime.time()))
+        earliest = _day_start(after.date()) + after.hour * 60 + after.minute
+        found = []
+        with self.lock:
+            for offset in range(days):
+                date = after.date() + datetime.timedelta(days=offset)
+                if not self.bookable(date):
+                    if date > self.today():
+                        break
+                    continue
+                day = _day_start(date)
+                for time in self._free_times(date, resource_ids):
+                    if day + _minutes(time) >= earliest:
+                        found.append((date.isoformat(), time))
+                        if len(found) == count:
+                            return found
+        return found
@@ -0,0 +1,232 @@
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from .database import Database
+from .memory import ConversationMemory
+from .tracing import tracer
+
+# Attempts before a save that keeps losing to other workers gives up.
+MAX_SAVE_ATTEMPTS = 3
+
+
+def _compact_block(block):
+    # SDK blocks dump every optional field; the ones left at None add nothing.
+    if not isinstance(block, dict):
+        block = block.model_dump()
+    return {key: value for key, value in block.items() if value is not None}
+
+
+def dump_content(content):
+    if not isinstance(content, str):
+        content = [_compact_block(block) for block in content]
+    return json.dumps(content, separators=(",", ":"), ensure_ascii=False)
+
+
+class Session:
+    """One user's conversation plus the UI state that goes with it."""
+
+    def __init__(self, session_id, user_id=None, state=None, messages=None):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.state = state if state is not None else {}
+        self.messages = messages if messages is not None else ConversationMemory()
+        # Where the stored copy stands: its revision, the first message still
+        # kept, and the position up to which messages have been written.
+        self.revision = 0
+        self.base_seq = 0
+        self.saved_seq = 0
+        self.saved_state = None
+
+
+class SessionStore(ABC):
+    """Where sessions live between requests. Subclasses decide how they persist."""
+
+    @abstractmethod
+    def load(self, session_id):
+        """Returns the session, or a new empty one if there is none."""
+
+    @abstractmethod
+    def save(self, session):
+        """Persists the session; returns False if the save could not be made."""
+
+    @abstractmethod
+    def delete(self, session_id):
+        """Forgets the session."""
+
+    def latest(self, user_id):
+        """Returns the id of the user's most recently saved session, or None."""
+        return None
+
+
+class _Conflict(Exception):
+    pass
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in the `sessions` / `session_messages` tables.
+
+    Each save only inserts the messages added since the last save (one row per
+    message, keyed by its position in the conversation), plus a rewrite of the
+    small session row; rows compacted out of a ConversationMemory are deleted.
+    Hot sessions stay in an LRU cache; a load checks the cached copy against the
+    session row's revision and, if another worker appended in the meantime, reads
+    just the new messages.
+    """
+
+    def __init__(self, db: Database, cache_size=256, memory_factory=ConversationMemory):
+        self.db = db
+        self.cache_size = cache_size
+        self.memory_factory = memory_factory
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+
+    def load(self, session_id):
+        with self.lock:
+            session = self.cache.get(session_id)
+        # The session row and the messages it counts are read from one snapshot;
+        # otherwise a save landing in between would be read twice.
+        with self.db.snapshot():
+            session, result = self._load(session_id, session)
+        tracer.count("appointment_session_loads_total", result=result)
+        self._remember(session)
+        return session
+
+    def _load(self, session_id, session):
+        row = self.db.fetchone('''SELECT user_id, state, memory, base_seq, next_seq, revision FROM sessions
+                                  WHERE session_id=?''', (session_id,))
+        if session is not None and session.messages.dropped + len(session.messages) != session.saved_seq:
+            # The cached copy holds changes that were never saved; start over
+            # from the stored one.
+            session = None
+        if row is None:
+            result = "miss"
+            session = Session(session_id, messages=self.memory_factory())
+        elif session is None or session.base_seq != row[3] or session.saved_seq > row[4]:
+            result = "miss"
+            session = self._read(session_id, row)
+        elif session.revision != row[5]:
+            result = "delta"
+            self._catch_up(session, row)
+        else:
+            result = "hit"
+        return session, result
+
+    def _read(self, session_id, row):
+        user_id, state, memory, base_seq, next_seq, revision = row
+        messages = self.memory_factory()
+        messages.restore_summary_state(json.loads(memory))
+        session = Session(session_id, user_id, json.loads(state), messages)
+        session.base_seq = session.saved_seq = base_seq
+        self._catch_up(session, row)
+        return session
+
+    def _catch_up(self, session, row):
+        # Another worker saved since this copy was cached; append what it added.
+        user_id, state, _, _, next_seq, revision = row
+        rows = self.db.fetchall('''SELECT role, content FROM session_messages
+                                   WHERE session_id=? AND seq >= ? ORDER BY seq''',
+                                (session.session_id, session.saved_seq))
+        session.messages.extend({"role": role, "content": json.loads(content)} for role, content in rows)
+        session.user_id = user_id
+        session.state = json.loads(state)
+        session.saved_state = (user_id, state)
+        session.saved_seq = next_seq
+        session.revision = revision
+
+    def save(self, session):
+        """Writes what changed since the last save; returns False if it could not.
+
+        Saves are optimistic: the session row only moves on if it is still at
+        the revision this copy was loaded at. If another worker saved first, this
+        copy is rebased onto the stored one, keeping its unsaved messages and its
+        state, and the save is retried.
+        """
+        for _ in range(MAX_SAVE_ATTEMPTS):
+            try:
+                self._save(session)
+                return True
+            except _Conflict:
+                tracer.count("appointment_session_save_conflicts_total")
+                self._rebase(session)
+        return False
+
+    def _save(self, session):
+        messages = session.messages
+        base_seq = messages.dropped
+        next_seq = base_seq + len(messages)
+        start = max(session.saved_seq - base_seq, 0)
+        new = [(session.session_id, base_seq + i, message["role"], dump_content(message["content"]))
+               for i, message in enumerate(messages[start:], start=start)]
+        saved_state = (session.user_id, json.dumps(session.state, separators=(",", ":")))
+        if not new and base_seq == session.base_seq and saved_state == session.saved_state:
+            # Nothing changed (e.g. a UI rerun); skip the write.
+            return
+        with self.db.transaction():
+            self.db.execute('''INSERT OR IGNORE INTO sessions (session_id) VALUES (?)''', (session.session_id,))
+            # Checked first, so a stale copy never gets as far as writing messages.
+            if self.db.execute('''UPDATE sessions SET user_id=?, state=?, next_seq=?, revision=revision+1, updated_at=?
+                                  WHERE session_id=? AND revision=?''',
+                               (*saved_state, next_seq, time.time(), session.session_id,
+                                session.revision)).rowcount != 1:
+                raise _Conflict
+            if new:
+                self.db.executemany('''INSERT INTO session_messages (session_id, seq, role, content)
+                                       VALUES (?, ?, ?, ?)''', new)
+            if base_seq != session.base_seq:
+                self.db.execute('''DELETE FROM session_messages WHERE session_id=? AND seq < ?''',
+                                (session.session_id, base_seq))
+                self.db.execute('''UPDATE sessions SET memory=?, base_seq=? WHERE session_id=?''',
+                                (json.dumps(messages.summary_state(), separators=(",", ":")), base_seq,
+                                 session.session_id))
+        session.revision += 1
+        session.base_seq = base_seq
+        session.saved_seq = next_seq
+        session.saved_state = saved_state
+        self._remember(session)
+
+    def _rebase(self, session):
+        # Replays this copy's unsaved messages on top of the stored session.
+        messages = session.messages
+        unsaved = messages[max(session.saved_seq - messages.dropped, 0):]
+        with self.db.snapshot():
+            stored, _ = self._load(session.session_id, None)
+        stored.messages.extend(unsaved)
+        # Only the state keys (and user) this copy changed since it was loaded
+        # override the stored ones; the other worker's changes are kept.
+        loaded_user_id, loaded_state = session.saved_state or (None, "{}")
+        loaded_state = json.loads(loaded_state)
+        state = dict(stored.state)
+        for key in loaded_state.keys() - session.state.keys():
+            state.pop(key, None)
+        state.update((key, value) for key, value in session.state.items()
+                     if key not in loaded_state or loaded_state[key] != value)
+        session.state.clear()
+        session.state.update(state)
+        if session.user_id == loaded_user_id:
+            session.user_id = stored.user_id
+        session.messages = stored.messages
+        session.revision = stored.revision
+        session.base_seq = stored.base_seq
+        session.saved_seq = stored.saved_seq
+        session.saved_state = stored.saved_state
+
+    def latest(self, user_id):
+        row = self.db.fetchone('''SELECT session_id FROM sessions WHERE user_id=?
+                                  ORDER BY updated_at DESC LIMIT 1''', (user_id,))
+        return row[0] if row else None
+
+    def delete(self, session_id):
+        with self.db.transaction():
+            self.db.execute('''DELETE FROM session_messages WHERE session_id=?''', (session_id,))
+            self.db.execute('''DELETE FROM sessions WHERE session_id=?''', (session_id,))
+        with self.lock:
+            self.cache.pop(session_id, None)
+
+    def _remember(self, session):
+        with self.lock:
+            self.cache[session.session_id] = session
+            self.cache.move_to_end(session.session_id)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
@@ -0,0 +1,80 @@
+# Tool definitions are generated from the AppointmentTools methods marked with
+# @tool: the method's signature and type hints give the JSON schema sent to the
+# model, and the same signature drives dispatch of the model's tool calls.
+import inspect
+import typing
+
+# Supplied by the Chatbot rather than the model, so never part of a schema.
+CONTEXT_PARAMS = frozenset({"user_id"})
+
+JSON_TYPES = {str: "string", int: "integer", float: "number", bool: "boolean"}
+
+
+def tool(description, **params):
+    """Marks a method as a tool; `params` are the descriptions of its arguments."""
+    def mark(method):
+        method.tool_description = description
+        method.tool_params = params
+        return method
+    return mark
+
+
+def _json_type(annotation):
+    if typing.get_origin(annotation) is typing.Union:
+        # Optional[X]: omitting the argument is how the model says None.
+        annotation = next(arg for arg in typing.get_args(annotation) if arg is not type(None))
+    if typing.get_origin(annotation) is list:
+        (item,) = typing.get_args(annotation)
+        return {"type": "array", "items": _json_type(item)}
+    return {"type": JSON_TYPES[annotation]}
+
+
+def _parameters(method):
+    return [param for name, param in inspect.signature(method).parameters.items()
+            if name != "self" and name not in CONTEXT_PARAMS]
+
+
+def tool_schema(method):
+    hints = typing.get_type_hints(method)
+    properties = {}
+    required = []
+    for param in _parameters(method):
+        properties[param.name] = _json_type(hints[param.name])
+        if param.name in method.tool_params:
+            properties[param.name]["description"] = method.tool_params[param.name]
+        if param.default is inspect.Parameter.empty:
+            required.append(param.name)
+    input_schema = {"type": "object", "properties": properties}
+    if required:
+        input_schema["required"] = required
+    return {"name": method.__name__, "description": method.tool_description, "input_schema": input_schema}
+
+
+def tool_methods(cls):
+    return [method for method in vars(cls).values() if hasattr(method, "tool_description")]
+
+
+def tool_schemas(cls):
+    return [tool_schema(method) for method in tool_methods(cls)]
+
+
+class ToolHandler:
+    # Calls a bound tool method with the model's input, dropping keys the method
+    # does not take; a missing required argument raises TypeError.
+    __slots__ = ("method", "params", "takes_user_id")
+
+    def __init__(self, method):
+        self.method = method
+        self.params = frozenset(param.name for param in _parameters(method))
+        self.takes_user_id = "user_id" in inspect.signature(method).parameters
+
+    def __call__(self, tool_input, user_id=None):
+        kwargs = {name: value for name, value in tool_input.items() if name in self.params}
+        if self.takes_user_id:
+            kwargs["user_id"] = user_id
+        return self.method(**kwargs)
+
+
+def dispatch_table(tools):
+    """{tool name: ToolHandler} for every @tool method of `tools`, an AppointmentTools."""
+    return {method.__name__: ToolHandler(getattr(tools, method.__name__)) for method in tool_methods(type(tools))}
@@ -1,113 +1,305 @@
-import json
+import datetime
+from .cache import ALL_DATES, ToolCache
 from .database import Database
-from .models import Booking
+from .holds import HoldReaper
+from .inventory import SlotInventory
+from .models import Booking, Resource, ToolResult
+from .schedule import Schedule, ScheduleRules
+from .tool_schemas import tool, tool_schemas
+
+DEFAULT_SLOTS = {
+    "2024-08-30": ["09:00", "10:00", "11:00", "14:00", "15:00"],
+    "2024-08-31": ["09:30", "10:30", "11:30", "14:30", "15:30"],
+    "2024-09-01": ["10:00", "11:00", "13:00", "14:00", "16:00"],
+}
 
 class AppointmentTools:
-    def __init__(self, db: Database):
+    def __init__(self, db: Database, slots=None, max_retries=3, cache=None, rules: ScheduleRules = None,
+                 resource_ids=None, hold_seconds=900, reaper=None):
         self.db = db
-        self.available_slots = {
-            "2024-08-30": {"09:00": True, "10:00": True, "11:00": True, "14:00": True, "15:00": True},
-            "2024-08-31": {"09:30": True, "10:30": True, "11:30": True, "14:30": True, "15:30": True},
-            "2024-09-01": {"10:00": True, "11:00": True, "13:00": True, "14:00": True, "16:00": True},
-        }
-
-    def get_available_time_slots(self, date):
-        if date in self.available_slots:
-            return [slot for slot, available in self.available_slots[date].items() if available]
-        return []
-
-    def create_booking(self, date, time, user_id):
-        if date in self.available_slots and time in self.available_slots[date] and self.available_slots[date][time]:
-            self.available_slots[date][time] = False
-            booking = Booking(user_id, date, time)
-            self.db.execute('''INSERT INTO bookings (user_id, date, time, status)
-                               VALUES (?, ?, ?, ?)''', 
-                            (booking.user_id, booking.date, booking.time, booking.status))
-            self.db.commit()
-            booking_id = self.db.cursor.lastrowid
-            return json.dumps({"status": "success", "message": f"Booking created for {date} at {time}", "booking_id": booking_id})
-        else:
-            return json.dumps({"status": "error", "message": "Slot not available"})
-
-    def cancel_booking(self, booking_id):
-        self.db.execute('''SELECT date, time, status FROM bookings WHERE booking_id=?''', (booking_id,))
-        result = self.db.fetchone()
-        
-        if result and result[2] == 'confirmed':
-            date, time = result[0], result[1]
-            self.db.execute('''DELETE FROM bookings WHERE booking_id=?''', (booking_id,))
-            self.db.commit()
-            if date in self.available_slots and time in self.available_slots[date]:
-                self.available_slots[date][time] = True
-            return json.dumps({"status": "success", "message": "Booking cancelled"})
+        self.max_retries = max_retries
+        self.hold_seconds = hold_seconds
+        self.cache = cache or ToolCache()
+        self.inventory = SlotInventory(db)
+        # Every write (ours or another process's) reaches the inventory as a set of
+        # changed dates, which is exactly what the cached results depend on.
+        self.inventory.listeners.append(self.cache.invalidate)
+        self.reaper = reaper or HoldReaper(db, self.inventory)
+        # By default every resource in the database, including ones added before a restart.
+        if resource_ids is None:
+            resource_ids = [resource_id for (resource_id,) in
+                            db.fetchall('''SELECT resource_id FROM resources ORDER BY resource_id''')]
+        self.resource_ids = set(resource_ids)
+        # With rules, days are generated on demand; explicit slots can still be added on top.
+        self.schedule = Schedule(rules, self.inventory, resource_ids) if rules is not None else None
+        if slots is not None or rules is None:
+            self.inventory.add_slots(DEFAULT_SLOTS if slots is None else slots, resource_ids)
+        # Started now rather than on the first hold, so holds left by other
+        # processes are swept even if this one never creates any.
+        self.reaper.start()
+
+    def add_resource(self, name, kind='provider', slots=None):
+        resource_id = self.db.add_resource(name, kind)
+        self.resource_ids.add(resource_id)
+        if self.schedule is not None:
+            self.schedule.add_resource(resource_id)
+        if slots:
+            self.inventory.add_slots(slots, (resource_id,))
+        return resource_id
+
+    def _ensure(self, date):
+        # False for dates the schedule does not offer (past or beyond its horizon).
+        return self.schedule is None or self.schedule.ensure(date)
+
+    def _outside_window(self):
+        last = self.schedule.today() + datetime.timedelta(days=self.schedule.rules.horizon_days - 1)
+        return ToolResult.error(f"Bookings can only be made from today until {last.isoformat()}")
+
+    def _unknown_resource(self, resource_id):
+        # resource_id comes from the model and ends up as a bit position in the
+        # inventory masks, so it has to name a resource before it gets there.
+        # Returns the error to send back, or None if it is fine.
+        if resource_id is None:
+            return None
+        # type() rather than isinstance: True and 1.0 would pass for resource 1.
+        if type(resource_id) is int and resource_id in self.resource_ids:
+            return None
+        if type(resource_id) is int and resource_id > 0:
+            # Possibly added by another process since this one started.
+            if self.db.fetchone('''SELECT 1 FROM resources WHERE resource_id=?''', (resource_id,)):
+                self.resource_ids.add(resource_id)
+                if self.schedule is not None:
+                    self.schedule.add_resource(resource_id)
+                return None
+        return ToolResult.error(f"Unknown provider or room {resource_id!r}; use list_resources to see them")
+
+    def _cached(self, key, dates, compute):
+        self.inventory.refresh()
+        result = self.cache.get(key)
+        if result is None:
+            version = self.inventory.version
+            result = compute()
+            # Skip the store if the inventory moved on while computing; the
+            # invalidation for that change may already have run.
+            if self.inventory.version == version:
+                self.cache.put(key, result, dates)
+        return result
+
+    def get_available_time_slots(self, date, resource_id=None):
+        if not self._ensure(date):
+            return []
+        return self.inventory.available_times(date, resource_id)
+
+    @tool("Create a booking for a specific date and time",
+          date="The date for the booking (format: YYYY-MM-DD)",
+          time="The time for the booking (format: HH:MM)",
+          resource_id="The provider or room to book; omit to take any free one")
+    def create_booking(self, date: str, time: str, user_id, resource_id: int = None):
+        error = self._unknown_resource(resource_id)
+        if error is not None:
+            return error
+        if not self._ensure(date):
+            return self._outside_window()
+        # The masks are only a hint; the conditional claim below is what decides.
+        # Without a resource_id, whichever free resource is claimed first wins.
+        # The booking starts as a pending hold that the reaper frees unless it
+        # is confirmed within hold_seconds.
+        for candidate in self.inventory.free_resources(date, time, resource_id):
+            booking = Booking(user_id, date, time, resource_id=candidate,
+                              expires_at=self.reaper.clock() + self.hold_seconds)
+            with self.db.transaction():
+                if self.db.claim_slot(date, time, candidate):
+                    booking_id = self.db.execute('''INSERT INTO bookings (user_id, date, time, status, resource_id, expires_at)
+                                                    VALUES (?, ?, ?, ?, ?, ?)''',
+                                                 (booking.user_id, booking.date, booking.time, booking.status,
+                                                  booking.resource_id, booking.expires_at)).lastrowid
+                else:
+                    booking_id = None
+            self.inventory.refresh()
+            if booking_id is not None:
+                self.reaper.add(booking.expires_at)
+                expires = datetime.datetime.fromtimestamp(booking.expires_at, datetime.timezone.utc)
+                return ToolResult.success(message=f"Booking created for {date} at {time}; confirm it before it expires",
+                                          booking_id=booking_id, resource_id=candidate,
+                                          expires_at=expires.isoformat(timespec='seconds'))
+        return ToolResult.error("Slot not available")
+
+    @tool("Cancel a booking using the booking ID", booking_id="The ID of the booking to be cancelled")
+    def cancel_booking(self, booking_id: int, user_id):
+        # Only the caller's own bookings; someone else's reads as non-existent.
+        with self.db.transaction():
+            booking = self.db.fetchone('''SELECT date, time, status, resource_id FROM bookings
+                                          WHERE booking_id=? AND user_id=?''',
+                                       (booking_id, user_id), Booking.from_row)
+            cancelled = booking is not None and booking.status == 'confirmed'
+            if cancelled:
+                self.db.execute('''DELETE FROM bookings WHERE booking_id=?''', (booking_id,))
+                self.db.release_slot(booking.date, booking.time, booking.resource_id)
+
+        if cancelled:
+            self.inventory.refresh()
+            return ToolResult.success(message="Booking cancelled")
         else:
-            return json.dumps({"status": "error", "message": "Cannot cancel unconfirmed or non-existent booking"})
-
-    def confirm_booking(self, booking_id, date, time):
-        self.db.execute('''SELECT status FROM bookings WHERE booking_id=?''', (booking_id,))
-        result = self.db.fetchone()
-        
-        if result and result[0] == 'pending':
-            self.db.execute('''UPDATE bookings SET status=? WHERE booking_id=?''', ('confirmed', booking_id))
-            self.db.commit()
-            self.available_slots[date][time] = False
-            return json.dumps({"status": "success", "message": f"Booking confirmed for {date} at {time}"})
+            return ToolResult.error("Cannot cancel unconfirmed or non-existent booking")
+
+    @tool("Confirm a booking after creating it",
+          booking_id="The ID of the booking to be confirmed",
+          date="The date for the booking (format: YYYY-MM-DD)",
+          time="The time for the booking (format: HH:MM)")
+    def confirm_booking(self, booking_id: int, date: str, time: str):
+        # The hold already owns the slot, so confirming is one conditional
+        # UPDATE: it either wins against the reaper or finds the hold gone.
+        confirmed = self.db.execute('''UPDATE bookings SET status=?, expires_at=NULL
+                                       WHERE booking_id=? AND status=? AND expires_at > ?''',
+                                    ('confirmed', booking_id, 'pending', self.reaper.clock())).rowcount == 1
+
+        if confirmed:
+            return ToolResult.success(message=f"Booking confirmed for {date} at {time}")
         else:
-            return json.dumps({"status": "error", "message": "Booking cannot be confirmed or does not exist"})
-        
-    def lookup_user(self, name, email, phone_number):
-        self.db.execute('''SELECT user_id FROM users WHERE name=? AND email=? AND phone_number=?''',
-                        (name, email, phone_number))
-        result = self.db.fetchone()
+            return ToolResult.error("Booking cannot be confirmed: it does not exist, is already confirmed or its hold expired")
+
+    @tool("Lookup a user based on provided details",
+          name="The name of the user", email="The email of the user", phone_number="The phone number of the user")
+    def lookup_user(self, name: str, email: str, phone_number: str):
+        result = self.db.fetchone('''SELECT user_id FROM users WHERE name=? AND email=? AND phone_number=?''',
+                                  (name, email, phone_number))
         if result:
-            return json.dumps({"status": "success", "user_id": result[0]})
+            return ToolResult.success(user_id=result[0])
+        else:
+            return ToolResult.error("User not found")
+
+    @tool("List the providers and rooms that can be booked",
+          kind="Only resources of this kind, e.g. provider or room")
+    def list_resources(self, kind: str = None):
+        if kind is None:
+            resources = self.db.fetchall('''SELECT resource_id, name, kind FROM resources ORDER BY resource_id''',
+                                         row_factory=Resource.from_row)
         else:
-            return json.dumps({"status": "error", "message": "User not found"})
+            resources = self.db.fetchall('''SELECT resource_id, name, kind FROM resources WHERE kind=? ORDER BY resource_id''',
+                                         (kind,), Resource.from_row)
+        return ToolResult({"resources": [resource.as_dict() for resource in resources]})
 
-    def select_appointment_date(self):
-        available_dates = [date for date, slots in self.available_slots.items() if any(slots.values())]
-        return json.dumps({"available_dates": available_dates})
+    @tool("Lets the user select a date for the appointment.",
+          resource_id="Only dates this provider or room has free; omit for any")
+    def select_appointment_date(self, resource_id: int = None):
+        error = self._unknown_resource(resource_id)
+        if error is not None:
+            return error
+        return self._cached(("select_appointment_date", resource_id), (ALL_DATES,),
+                            lambda: self._select_appointment_date(resource_id))
 
-    def select_time_slot(self, date):
-        available_time_slots = self.get_available_time_slots(date)
-        if available_time_slots:
-            return json.dumps({"available_time_slots": available_time_slots})
+    def _select_appointment_date(self, resource_id):
+        if self.schedule is not None:
+            available_dates = self.schedule.available_dates(resource_ids=resource_id)
         else:
-            return json.dumps({"status": "error", "message": "No available slots for the selected date."})
+            available_dates = self.inventory.available_dates(resource_id)
+        return ToolResult({"available_dates": available_dates})
 
-    def change_booking_date(self, booking_id, new_date):
-        self.db.execute('''SELECT date, time FROM bookings WHERE booking_id=?''', (booking_id,))
-        result = self.db.fetchone()
-        if result:
-            old_date, old_time = result
-            available_time_slots = self.get_available_time_slots(new_date)
-            if available_time_slots:
-                self.db.execute('''UPDATE bookings SET date=? WHERE booking_id=?''', (new_date, booking_id))
-                self.db.commit()
-                if old_date in self.available_slots and old_time in self.available_slots[old_date]:
-                    self.available_slots[old_date][old_time] = True
-                return json.dumps({
-                    "status": "success", 
-                    "message": f"Booking date changed to {new_date}",
-                    "available_time_slots": available_time_slots
-                })
-            else:
-                return json.dumps({"status": "error", "message": "No available time slots for the selected date"})
+    @tool("Lets the user select a time slot from available options for the chosen date.",
+          date="The selected appointment date.", resource_id="Only slots of this provider or room; omit for any")
+    def select_time_slot(self, date: str, resource_id: int = None):
+        error = self._unknown_resource(resource_id)
+        if error is not None:
+            return error
+        if not self._ensure(date):
+            return self._outside_window()
+        return self._cached(("select_time_slot", date, resource_id), (date,),
+                            lambda: self._select_time_slot(date, resource_id))
+
+    def _select_time_slot(self, date, resource_id):
+        available_time_slots = self.get_available_time_slots(date, resource_id)
+        if available_time_slots:
+            return ToolResult({"available_time_slots": available_time_slots})
         else:
-            return json.dumps({"status": "error", "message": "Booking not found"})
+            return ToolResult.error("No available slots for the selected date.")
 
-    def change_booking_time(self, booking_id, new_time):
-        self.db.execute('''SELECT date, time FROM bookings WHERE booking_id=?''', (booking_id,))
-        result = self.db.fetchone()
-        if result:
-            date, old_time = result
-            if date in self.available_slots and new_time in self.available_slots[date] and self.available_slots[date][new_time]:
-                self.db.execute('''UPDATE bookings SET time=? WHERE booking_id=?''', (new_time, booking_id))
-                self.db.commit()
-                self.available_slots[date][old_time] = True
-                self.available_slots[date][new_time] = False
-                return json.dumps({"status": "success", "message": f"Booking time changed to {new_time}"})
-            else:
-                return json.dumps({"status": "error", "message": "Selected time slot is not available"})
+    @tool("Find the earliest available slots at or after a given time",
+          after="Start searching from this time (format: YYYY-MM-DD HH:MM); defaults to now",
+          count="How many slots to return (default 5)",
+          resource_id="Only slots of this provider or room; omit to search all of them")
+    def next_available_slots(self, after: str = None, count: int = 5, resource_id: int = None):
+        error = self._unknown_resource(resource_id)
+        if error is not None:
+            return error
+        try:
+            after = datetime.datetime.fromisoformat(after) if after else datetime.datetime.now()
+        except ValueError:
+            return ToolResult.error("Invalid start time, use YYYY-MM-DD HH:MM")
+        self.inventory.refresh()
+        if self.schedule is not None:
+            slots = self.schedule.next_available(after, count, resource_ids=resource_id)
+        else:
+            earliest = after.strftime("%Y-%m-%d %H:%M")
+            slots = [(date, time) for date in self.inventory.available_dates(resource_id)
+                     for time in self.inventory.available_times(date, resource_id) if f"{date} {time}" >= earliest][:count]
+        if slots:
+            return ToolResult({"available_slots": [{"date": date, "time": time} for date, time in slots]})
         else:
-            return json.dumps({"status": "error", "message": "Booking not found"})
\ No newline at end of file
+            return ToolResult.error("No available slots found.")
+
+    @tool("Change the date of an existing booking",
+          booking_id="The ID of the booking to be changed", new_date="The new date for the booking (format: YYYY-MM-DD)",
+          new_time="The new time for the booking (format: HH:MM); omit to keep the current time")
+    def change_booking_date(self, booking_id: int, new_date: str, new_time: str = None):
+        # Same as change_booking_time: claim the new slot, move the booking only
+        # if it still has the date/time we read, release the old slot, all in
+        # one transaction; if the booking changed meanwhile, re-read and retry.
+        for _ in range(self.max_retries):
+            booking = self.db.fetchone('''SELECT date, time, resource_id FROM bookings WHERE booking_id=?''',
+                                       (booking_id,), Booking.from_row)
+            if booking is None:
+                return ToolResult.error("Booking not found")
+            if not self._ensure(new_date):
+                return self._outside_window()
+            time = new_time or booking.time
+            available_time_slots = self.get_available_time_slots(new_date, booking.resource_id)
+            if not available_time_slots:
+                return ToolResult.error("No available time slots for the selected date")
+            if time not in available_time_slots:
+                return ToolResult({"status": "error",
+                                   "message": f"{time} is not available on {new_date}; pick one of the available time slots",
+                                   "available_time_slots": available_time_slots})
+            with self.db.transaction() as conn:
+                claimed = self.db.claim_slot(new_date, time, booking.resource_id)
+                moved = claimed and self.db.execute('''UPDATE bookings SET date=?, time=? WHERE booking_id=? AND date=? AND time=?''',
+                                                    (new_date, time, booking_id, booking.date, booking.time)).rowcount == 1
+                if moved:
+                    self.db.release_slot(booking.date, booking.time, booking.resource_id)
+                elif claimed:
+                    conn.rollback()
+            self.inventory.refresh()
+            if moved:
+                return ToolResult.success(message=f"Booking moved to {new_date} at {time}")
+            if not claimed:
+                return ToolResult.error("Selected time slot is not available")
+        return ToolResult.error("Booking was modified concurrently, please try again")
+
+    @tool("Change the time of an existing booking",
+          booking_id="The ID of the booking to be changed", new_time="The new time for the booking (format: HH:MM)")
+    def change_booking_time(self, booking_id: int, new_time: str):
+        for _ in range(self.max_retries):
+            booking = self.db.fetchone('''SELECT date, time, resource_id FROM bookings WHERE booking_id=?''',
+                                       (booking_id,), Booking.from_row)
+            if booking is None:
+                return ToolResult.error("Booking not found")
+            date, old_time, resource_id = booking.date, booking.time, booking.resource_id
+            if not self.inventory.is_available(date, new_time, resource_id):
+                return ToolResult.error("Selected time slot is not available")
+            with self.db.transaction() as conn:
+                claimed = self.db.claim_slot(date, new_time, resource_id)
+                moved = claimed and self.db.execute('''UPDATE bookings SET time=? WHERE booking_id=? AND date=? AND time=?''',
+                                                    (new_time, booking_id, date, old_time)).rowcount == 1
+                if moved:
+                    self.db.release_slot(date, old_time, resource_id)
+                elif claimed:
+                    conn.rollback()
+            self.inventory.refresh()
+            if moved:
+                return ToolResult.success(message=f"Booking time changed to {new_time}")
+            if not claimed:
+                return ToolResult.error("Selected time slot is not available")
+        return ToolResult.error("Booking was modified concurrently, please try again")
+
+
+# The tool definitions sent to the model, generated from the @tool methods above.
+TOOLS = tool_schemas(AppointmentTools)
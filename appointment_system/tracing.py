@@ -0,0 +1,191 @@
+import bisect
+import contextvars
+import json
+import threading
+import time
+import uuid
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    def __init__(self, tracer, name, metric, labels, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.metric = metric
+        self.labels = labels
+        self.attributes = attributes
+        self.parent = None
+        self.trace_id = None
+        self.span_id = None
+        self.start = 0.0
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        self.trace_id = self.parent.trace_id if self.parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        _current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        _current_span.set(self.parent)
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.tracer.observe(self.metric, duration, **self.labels)
+        self.tracer.write_span(self, duration)
+        return False
+
+
+class Tracer:
+    """Spans, histograms and counters for the model, tool and database layers.
+
+    Disabled by default: `span` then hands back a shared no-op object and
+    `observe`/`count` return straight away, so instrumented code pays one
+    attribute check. When enabled, every span feeds a latency histogram, and is
+    also written as one JSON line to `trace_path` if that is set. `to_prometheus`
+    renders all aggregates in the Prometheus text format.
+    """
+
+    def __init__(self, enabled=False, trace_path=None, buckets=DEFAULT_BUCKETS):
+        self.lock = threading.Lock()
+        self.buckets = buckets
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.trace_file = None
+        self.enabled = False
+        self.configure(enabled, trace_path)
+
+    def configure(self, enabled=True, trace_path=None):
+        with self.lock:
+            if self.trace_file is not None:
+                self.trace_file.close()
+            self.trace_file = open(trace_path, "a", buffering=1) if trace_path else None
+            self.enabled = enabled
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.gauges.clear()
+
+    def span(self, name, metric, **labels):
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, metric, labels, dict(labels))
+
+    def observe(self, metric, value, **labels):
+        if not self.enabled:
+            return
+        key = (metric, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def count(self, metric, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (metric, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, metric, value, **labels):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.gauges[(metric, tuple(sorted(labels.items())))] = value
+
+    def write_span(self, span, duration):
+        if self.trace_file is None:
+            return
+        line = json.dumps({
+            "trace_id": span.trace_id,
+            "span_id": span.span_id,
+            "parent_id": span.parent.span_id if span.parent else None,
+            "name": span.name,
+            "start": time.time() - duration,
+            "duration_ms": duration * 1000,
+            "attributes": span.attributes,
+        }, default=str)
+        with self.lock:
+            if self.trace_file is not None:
+                self.trace_file.write(line + "\n")
+
+    def to_prometheus(self):
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            snapshots = [(key, list(h.counts), h.sum, h.count) for key, h in histograms]
+
+        lines = []
+        typed = set()
+        for (metric, labels), value in counters:
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_labels(labels)} {value}")
+        for (metric, labels), value in gauges:
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric}{_labels(labels)} {value}")
+        for (metric, labels), counts, total, count in snapshots:
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{metric}_bucket{_labels(labels + (('le', repr(bound)),))} {cumulative}")
+            lines.append(f"{metric}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{metric}_sum{_labels(labels)} {total}")
+            lines.append(f"{metric}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+# Process-wide tracer used by Database, AppointmentTools and Chatbot.
+tracer = Tracer()
@@ -1,29 +1,42 @@
 import re
 
+# Compiled once; validate_user_data runs per row during bulk imports.
+EMAIL_PATTERN = re.compile(r'^[\w\.-]+@[\w\.-]+\.\w+$')
+PHONE_PATTERN = re.compile(r'^[0-9]{10}$')
+
+def as_text(value):
+    # Numbers (e.g. a phone number in JSON) become their digits; anything that
+    # is not a scalar becomes '' and fails validation.
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return ''
+
 def validate_user_data(user_data):
     errors = {}
     if 'name' in user_data:
-        name = user_data['name']
+        name = as_text(user_data['name'])
         if not name.replace(" ", "").isalpha():
             errors['name'] = 'Name must contain only alphabets and spaces.'
-    
+
     if 'email' in user_data:
-        email = user_data['email']
-        if not re.match(r'^[\w\.-]+@[\w\.-]+\.\w+$', email):
+        email = as_text(user_data['email'])
+        if not EMAIL_PATTERN.match(email):
             errors['email'] = 'Invalid email address.'
-    
+
     if 'phone_number' in user_data:
-        phone_number = user_data['phone_number']
-        if not re.match(r'^[0-9]{10}$', phone_number):
+        phone_number = as_text(user_data['phone_number'])
+        if not PHONE_PATTERN.match(phone_number):
             errors['phone_number'] = 'Phone number must be exactly 10 digits.'
-    
+
     if 'age' in user_data:
         try:
             age = int(user_data['age'])
-        except ValueError:
+        except (TypeError, ValueError):
             errors['age'] = 'Age must be a valid number.'
         else:
             if not (0 < age < 100):
                 errors['age'] = 'Age must be between 1 and 99.'
-    
+
     return errors
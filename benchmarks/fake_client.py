@@ -0,0 +1,123 @@
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+import uuid
+
+
+class Block:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+    def model_dump(self):
+        return dict(self.__dict__)
+
+
+class Usage:
+    def __init__(self, input_tokens, output_tokens, cache_creation_input_tokens=0, cache_read_input_tokens=0):
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.cache_creation_input_tokens = cache_creation_input_tokens
+        self.cache_read_input_tokens = cache_read_input_tokens
+
+
+class Message:
+    def __init__(self, content, stop_reason, usage):
+        self.content = content
+        self.stop_reason = stop_reason
+        self.usage = usage
+
+
+# What the scripted "model" understands: one tool call per recognised request.
+INTENTS = [
+    (re.compile(r'what dates are free', re.I), lambda m: ("select_appointment_date", {})),
+    (re.compile(r'slots on (\S+)', re.I), lambda m: ("select_time_slot", {"date": m.group(1)})),
+    (re.compile(r'book (\S+) (\S+)', re.I), lambda m: ("create_booking", {"date": m.group(1), "time": m.group(2)})),
+    (re.compile(r'confirm booking (\d+) on (\S+) at (\S+)', re.I),
+     lambda m: ("confirm_booking", {"booking_id": int(m.group(1)), "date": m.group(2), "time": m.group(3)})),
+    (re.compile(r'move booking (\d+) to (\S+)', re.I),
+     lambda m: ("change_booking_time", {"booking_id": int(m.group(1)), "new_time": m.group(2)})),
+    (re.compile(r'cancel booking (\d+)', re.I), lambda m: ("cancel_booking", {"booking_id": int(m.group(1))})),
+]
+
+
+class ScriptedModel:
+    """Decides the next response from the conversation, like the real model would.
+
+    A user text message that matches one of INTENTS produces a tool_use block;
+    tool results are echoed back verbatim in an end_turn text reply, so callers
+    can parse booking ids out of the reply. Latency is `latency` seconds plus a
+    uniform jitter of up to `jitter` seconds; token counts are estimated from the
+    request size.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, output_tokens=60, prompt_tokens=1500, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.output_tokens = output_tokens
+        self.prompt_tokens = prompt_tokens
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def delay(self):
+        with self.lock:
+            self.calls += 1
+            return self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def respond(self, messages, **kwargs):
+        last = messages[-1]["content"]
+        if isinstance(last, list) and last and last[0].get("type") == "text":
+            last = last[0]["text"]
+        usage = Usage(
+            input_tokens=len(json.dumps(messages, default=str)) // 4,
+            output_tokens=self.output_tokens,
+            cache_read_input_tokens=self.prompt_tokens,
+        )
+        if isinstance(last, str):
+            for pattern, tool in INTENTS:
+                found = pattern.search(last)
+                if found:
+                    name, tool_input = tool(found)
+                    return Message(
+                        [Block(type="tool_use", id=f"toolu_{uuid.uuid4().hex[:24]}", name=name, input=tool_input)],
+                        "tool_use", usage)
+            return Message([Block(type="text", text="I can help you book an appointment.")], "end_turn", usage)
+        results = [block.get("content") for block in last if block.get("type") == "tool_result"]
+        return Message([Block(type="text", text="Done: " + " ".join(map(str, results)))], "end_turn", usage)
+
+
+class _Messages:
+    def __init__(self, model):
+        self.model = model
+
+    def create(self, messages, **kwargs):
+        time.sleep(self.model.delay())
+        return self.model.respond(messages, **kwargs)
+
+
+class _AsyncMessages:
+    def __init__(self, model):
+        self.model = model
+
+    async def create(self, messages, **kwargs):
+        await asyncio.sleep(self.model.delay())
+        return self.model.respond(messages, **kwargs)
+
+
+class FakeAnthropic:
+    """Stand-in for `anthropic.Anthropic`; pass it to `Chatbot(client=...)`."""
+
+    def __init__(self, model=None, **options):
+        self.model = model or ScriptedModel(**options)
+        self.messages = _Messages(self.model)
+
+
+class FakeAsyncAnthropic:
+    """Stand-in for `anthropic.AsyncAnthropic`; pass it to `AsyncChatbot(client=...)`."""
+
+    def __init__(self, model=None, **options):
+        self.model = model or ScriptedModel(**options)
+        self.messages = _AsyncMessages(self.model)
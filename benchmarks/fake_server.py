@@ -0,0 +1,164 @@
+"""A local HTTP stand-in for the Messages API, with its own rate limits.
+
+FakeAPIServer answers POST /v1/messages with ScriptedModel responses. It
+enforces requests- and tokens-per-minute limits like the real API (429 with a
+retry-after header) and can fail a fraction of requests with 529 overloaded.
+HTTPClient is a minimal `client.messages.create` over urllib, raising errors
+that carry `status_code` and `response.headers` the way the SDK's do; the
+real SDK can also be pointed at the server with `base_url`.
+"""
+import json
+import math
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .fake_client import Block, Message, ScriptedModel, Usage
+
+
+class _Window:
+    # Strict limit: a request is refused (not queued) if the budget is short.
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def take(self, amount):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.level >= amount:
+            self.level -= amount
+            return 0.0
+        return (amount - self.level) / self.rate
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 resets connections under a burst of clients.
+    request_queue_size = 256
+
+
+class FakeAPIServer:
+    def __init__(self, model=None, requests_per_minute=None, tokens_per_minute=None, overload_rate=0.0,
+                 host="127.0.0.1", port=0, seed=None):
+        self.model = model or ScriptedModel()
+        self.requests = _Window(requests_per_minute) if requests_per_minute else None
+        self.tokens = _Window(tokens_per_minute) if tokens_per_minute else None
+        self.overload_rate = overload_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.statuses = {}
+        self.httpd = _HTTPServer((host, port), self._handler())
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _admit(self, request):
+        # Returns (status, retry_after) for a request before it reaches the model.
+        tokens = len(json.dumps(request)) // 4 + request.get("max_tokens", 0)
+        with self.lock:
+            if self.overload_rate and self.random.random() < self.overload_rate:
+                return 529, None
+            wait = self.requests.take(1) if self.requests else 0.0
+            if not wait and self.tokens:
+                wait = self.tokens.take(tokens)
+                if wait and self.requests:
+                    self.requests.level += 1
+            if wait:
+                return 429, wait
+        return 200, None
+
+    def _count(self, status):
+        with self.lock:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                if self.path.rstrip("/") != "/v1/messages":
+                    self.send_error(404)
+                    return
+                request = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))))
+                status, retry_after = server._admit(request)
+                server._count(status)
+                if status != 200:
+                    kind = "rate_limit_error" if status == 429 else "overloaded_error"
+                    body = {"type": "error", "error": {"type": kind, "message": kind}}
+                    headers = {"retry-after": str(math.ceil(retry_after))} if retry_after else {}
+                    self._reply(status, body, headers)
+                    return
+                time.sleep(server.model.delay())
+                message = server.model.respond(request["messages"])
+                self._reply(200, {
+                    "id": "msg_fake",
+                    "type": "message",
+                    "role": "assistant",
+                    "model": request.get("model"),
+                    "content": [block.model_dump() for block in message.content],
+                    "stop_reason": message.stop_reason,
+                    "usage": dict(vars(message.usage)),
+                })
+
+            def _reply(self, status, body, headers=None):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+class APIStatusError(Exception):
+    def __init__(self, status_code, response, body):
+        super().__init__(f"HTTP {status_code}: {body}")
+        self.status_code = status_code
+        self.response = response
+
+
+class _Messages:
+    def __init__(self, base_url, timeout):
+        self.url = base_url.rstrip("/") + "/v1/messages"
+        self.timeout = timeout
+
+    def create(self, **request):
+        data = json.dumps(request, default=lambda block: block.model_dump()).encode()
+        http_request = urllib.request.Request(self.url, data=data, headers={"content-type": "application/json"})
+        try:
+            with urllib.request.urlopen(http_request, timeout=self.timeout) as response:
+                body = json.loads(response.read())
+        except urllib.error.HTTPError as error:
+            raise APIStatusError(error.code, error, error.read().decode()) from None
+        return Message([Block(**block) for block in body["content"]], body["stop_reason"], Usage(**body["usage"]))
+
+
+class HTTPClient:
+    """Stand-in for `anthropic.Anthropic` that talks to a FakeAPIServer."""
+
+    def __init__(self, base_url, timeout=30.0):
+        self.messages = _Messages(base_url, timeout)
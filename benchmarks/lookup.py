@@ -0,0 +1,106 @@
+"""Measure user lookup and booking query latency as the tables grow.
+
+    python -m benchmarks.lookup --sizes 10000 100000 1000000 --output lookup.json
+
+The same database is grown to each size in turn; at every size a batch of
+lookup_user calls (hits and misses) and booking queries is timed. With the
+indexes from schema version 2 the latencies should stay flat as size grows.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import tempfile
+import time
+
+from appointment_system import AppointmentTools, Database
+
+from .run import git_commit, summarize
+
+
+def user_row(i):
+    return (f"User {i}", f"user{i}@example.com", f"{i:010d}", 20 + i % 60, 'available')
+
+
+def grow(db, start, stop, chunk=50_000, bookings_per_user=0.1, seed=0):
+    rng = random.Random(seed + start)
+    for low in range(start, stop, chunk):
+        high = min(stop, low + chunk)
+        db.executemany('''INSERT INTO users (name, email, phone_number, age, appointment_status)
+                          VALUES (?, ?, ?, ?, ?)''', (user_row(i) for i in range(low, high)))
+        bookings = []
+        for i in range(low, high):
+            if rng.random() < bookings_per_user:
+                day = datetime.date(2025, 1, 1) + datetime.timedelta(days=rng.randrange(365))
+                bookings.append((i + 1, day.isoformat(), f"{rng.randrange(9, 17):02d}:00",
+                                 rng.choice(('pending', 'confirmed'))))
+        db.executemany('''INSERT INTO bookings (user_id, date, time, status) VALUES (?, ?, ?, ?)''', bookings)
+
+
+def measure(db, appointment_tools, size, samples, rng):
+    timings = {"lookup_user_hit": [], "lookup_user_miss": [], "bookings_by_user": [], "bookings_by_slot": []}
+    for _ in range(samples):
+        name, email, phone_number, _, _ = user_row(rng.randrange(size))
+        start = time.perf_counter()
+        appointment_tools.lookup_user(name, email, phone_number)
+        timings["lookup_user_hit"].append(time.perf_counter() - start)
+
+        name, email, phone_number, _, _ = user_row(size + rng.randrange(size))
+        start = time.perf_counter()
+        appointment_tools.lookup_user(name, email, phone_number)
+        timings["lookup_user_miss"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        db.fetchall('''SELECT booking_id, date, time FROM bookings WHERE user_id=? AND status=?''',
+                    (rng.randrange(size) + 1, 'confirmed'))
+        timings["bookings_by_user"].append(time.perf_counter() - start)
+
+        day = datetime.date(2025, 1, 1) + datetime.timedelta(days=rng.randrange(365))
+        start = time.perf_counter()
+        db.fetchall('''SELECT booking_id FROM bookings WHERE date=? AND time=?''',
+                    (day.isoformat(), f"{rng.randrange(9, 17):02d}:00"))
+        timings["bookings_by_slot"].append(time.perf_counter() - start)
+    return {name: summarize(values) for name, values in timings.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", help="database file (default: a temporary file)")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    workdir = None
+    db_path = args.db
+    if db_path is None:
+        workdir = tempfile.TemporaryDirectory()
+        db_path = os.path.join(workdir.name, "lookup.db")
+
+    db = Database(db_path)
+    appointment_tools = AppointmentTools(db)
+    rng = random.Random(args.seed)
+    results = {"commit": git_commit(), "config": vars(args), "sizes": {}}
+    size = 0
+    for target in sorted(args.sizes):
+        start = time.perf_counter()
+        grow(db, size, target, seed=args.seed)
+        load_s = time.perf_counter() - start
+        size = target
+        results["sizes"][str(size)] = {"load_s": load_s, **measure(db, appointment_tools, size, args.samples, rng)}
+        hit = results["sizes"][str(size)]["lookup_user_hit"]
+        print(f"{size:>10} users  lookup p50 {hit['p50_ms']:.3f} ms  p99 {hit['p99_ms']:.3f} ms  (load {load_s:.1f}s)")
+
+    db.close()
+    if workdir is not None:
+        workdir.cleanup()
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(json.dumps(results, indent=2) + "\n")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Drive conversations through the local fake API server, with and without the RateLimiter.
+
+    python -m benchmarks.ratelimit --conversations 100 --concurrency 32 --server-rpm 600 --overload-rate 0.05
+
+Without the limiter, bursts run into the server's 429s and 529s and turns
+fail; with it, they queue, back off and complete.
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from appointment_system import AppointmentTools, Chatbot, Database, RateLimiter, tracer
+
+from .fake_client import ScriptedModel
+from .fake_server import FakeAPIServer, HTTPClient
+from .run import Conversation, generate_slots, git_commit, summarize
+
+
+def run_conversation(chatbot, conversation, outcomes, lock):
+    for prompt in conversation.script():
+        conversation.messages.append({"role": "user", "content": prompt})
+        start = time.perf_counter()
+        try:
+            chatbot.chat(prompt, conversation.user_id, conversation.messages)
+        except Exception as exc:
+            with lock:
+                outcomes["failed"].append(type(exc).__name__)
+            return
+        with lock:
+            outcomes["turns"].append(time.perf_counter() - start)
+
+
+def run(args, limited):
+    workdir = tempfile.TemporaryDirectory()
+    db = Database(os.path.join(workdir.name, "bench.db"), pool_size=8)
+    appointment_tools = AppointmentTools(db, slots=generate_slots(args.days))
+    user_ids = [db.execute('''INSERT INTO users (name, email, phone_number, age, appointment_status)
+                              VALUES (?, ?, ?, ?, ?)''',
+                           (f"User {i}", f"user{i}@example.com", f"{i:010d}", 30, 'available')).lastrowid
+                for i in range(args.conversations)]
+    conversations = [Conversation(i, user_ids[i], args.seed, 0.0, 0.0) for i in range(args.conversations)]
+    limiter = RateLimiter(requests_per_minute=args.limit_rpm, tokens_per_minute=args.limit_tpm,
+                          max_concurrency=args.max_concurrency, base_delay=args.base_delay,
+                          seed=args.seed) if limited else None
+    model = ScriptedModel(latency=args.latency_ms / 1000, seed=args.seed)
+    outcomes = {"turns": [], "failed": []}
+    lock = threading.Lock()
+    tracer.reset()
+
+    with FakeAPIServer(model, requests_per_minute=args.server_rpm, tokens_per_minute=args.server_tpm,
+                       overload_rate=args.overload_rate, seed=args.seed) as server:
+        chatbot = Chatbot("", "fake-model", [], db, appointment_tools, client=HTTPClient(server.base_url),
+                          limiter=limiter)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(lambda conversation: run_conversation(chatbot, conversation, outcomes, lock),
+                          conversations))
+        elapsed = time.perf_counter() - start
+
+    appointment_tools.reaper.stop()
+    db.close()
+    workdir.cleanup()
+    return {
+        "limiter": limited,
+        "elapsed_s": elapsed,
+        "turns": len(outcomes["turns"]),
+        "failed_conversations": len(outcomes["failed"]),
+        "errors": {name: outcomes["failed"].count(name) for name in set(outcomes["failed"])},
+        "turns_per_second": len(outcomes["turns"]) / elapsed if elapsed else 0.0,
+        "turn_latency": summarize(outcomes["turns"]),
+        "server_statuses": {str(status): count for status, count in sorted(server.statuses.items())},
+        "retries": limiter.retries if limiter else 0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--conversations", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--server-rpm", type=int, default=600, help="requests per minute the server accepts")
+    parser.add_argument("--server-tpm", type=int, default=None, help="tokens per minute the server accepts")
+    parser.add_argument("--overload-rate", type=float, default=0.02, help="fraction of requests failed with 529")
+    parser.add_argument("--limit-rpm", type=int, default=550, help="RateLimiter requests per minute")
+    parser.add_argument("--limit-tpm", type=int, default=10_000_000, help="RateLimiter tokens per minute")
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--base-delay", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    results = {"commit": git_commit(), "config": vars(args),
+               "runs": [run(args, limited=False), run(args, limited=True)]}
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""Drive simulated booking conversations through Chatbot and report throughput.
+
+    python -m benchmarks.run --conversations 2000 --concurrency 32 --latency-ms 50 --output results.json
+
+No API key or network access is needed: the model is replaced by the scripted
+fake client in benchmarks.fake_client.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from appointment_system import AppointmentTools, AsyncChatbot, Chatbot, ConversationMemory, Database, IntentRouter, tracer
+
+from .fake_client import FakeAnthropic, FakeAsyncAnthropic, ScriptedModel
+
+
+def generate_slots(days, start=datetime.date(2024, 9, 2), first_hour=9, last_hour=17, minutes=30):
+    slots = {}
+    for offset in range(days):
+        date = (start + datetime.timedelta(days=offset)).isoformat()
+        slots[date] = [f"{minute // 60:02d}:{minute % 60:02d}"
+                       for minute in range(first_hour * 60, last_hour * 60, minutes)]
+    return slots
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "mean_ms": 1000 * sum(values) / len(values) if values else 0.0,
+        "p50_ms": 1000 * percentile(values, 0.50),
+        "p95_ms": 1000 * percentile(values, 0.95),
+        "p99_ms": 1000 * percentile(values, 0.99),
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.turns = []
+        self.tools = {}
+
+    def turn(self, seconds):
+        with self.lock:
+            self.turns.append(seconds)
+
+    def tool(self, name, seconds):
+        with self.lock:
+            self.tools.setdefault(name, []).append(seconds)
+
+    def timed(self, chatbot):
+        # Time every tool call, i.e. the database work behind it.
+        process_tool_call = chatbot.process_tool_call
+
+        def timed_process_tool_call(tool_name, tool_input, user_id=None):
+            start = time.perf_counter()
+            try:
+                return process_tool_call(tool_name, tool_input, user_id)
+            finally:
+                self.tool(tool_name, time.perf_counter() - start)
+
+        chatbot.process_tool_call = timed_process_tool_call
+        return chatbot
+
+
+class Conversation:
+    """One simulated user: list dates, list slots, book, confirm, maybe move or cancel."""
+
+    def __init__(self, index, user_id, seed, change_rate, cancel_rate):
+        self.random = random.Random(seed * 1_000_003 + index)
+        self.user_id = user_id
+        self.change_rate = change_rate
+        self.cancel_rate = cancel_rate
+        self.messages = ConversationMemory()
+
+    def last_tool_result(self):
+        # Read what the tool returned from the transcript rather than the reply
+        # text, so the same script works with or without the IntentRouter.
+        for message in reversed(self.messages):
+            if isinstance(message["content"], list):
+                for block in message["content"]:
+                    if isinstance(block, dict) and block.get("type") == "tool_result":
+                        try:
+                            return json.loads(block["content"])
+                        except ValueError:
+                            return {}
+            elif message["role"] == "user":
+                return {}
+        return {}
+
+    def script(self):
+        yield "What dates are free?"
+        dates = self.last_tool_result().get("available_dates")
+        if not dates:
+            return
+        date = self.random.choice(dates)
+        yield f"Slots on {date}"
+        times = self.last_tool_result().get("available_time_slots")
+        if not times:
+            return
+        time_ = self.random.choice(times)
+        yield f"Book {date} {time_}"
+        booking = self.last_tool_result()
+        if booking.get("status") != "success":
+            return
+        booking_id = booking["booking_id"]
+        yield f"Confirm booking {booking_id} on {date} at {time_}"
+        if self.random.random() < self.change_rate:
+            yield f"Slots on {date}"
+            times = self.last_tool_result().get("available_time_slots")
+            if times:
+                yield f"Move booking {booking_id} to {self.random.choice(times)}"
+        if self.random.random() < self.cancel_rate:
+            yield f"Cancel booking {booking_id}"
+
+
+def run_conversation(chatbot, conversation, recorder):
+    for prompt in conversation.script():
+        conversation.messages.append({"role": "user", "content": prompt})
+        start = time.perf_counter()
+        chatbot.chat(prompt, conversation.user_id, conversation.messages)
+        recorder.turn(time.perf_counter() - start)
+
+
+async def run_conversation_async(chatbot, conversation, recorder, semaphore):
+    async with semaphore:
+        for prompt in conversation.script():
+            conversation.messages.append({"role": "user", "content": prompt})
+            start = time.perf_counter()
+            await chatbot.chat(prompt, conversation.user_id, conversation.messages)
+            recorder.turn(time.perf_counter() - start)
+
+
+def check_bookings(db):
+    double_booked = db.fetchone('''SELECT COUNT(*) FROM (SELECT resource_id, date, time FROM bookings
+                                   GROUP BY resource_id, date, time HAVING COUNT(*) > 1)''')[0]
+    free_but_booked = db.fetchone('''SELECT COUNT(*) FROM slots s
+                                     WHERE s.available = 1
+                                     AND EXISTS (SELECT 1 FROM bookings b WHERE b.resource_id = s.resource_id
+                                                 AND b.date = s.date AND b.time = s.time)''')[0]
+    return {"double_bookings": double_booked, "booked_slots_marked_free": free_but_booked}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    workdir = None
+    db_path = args.db
+    if db_path is None:
+        workdir = tempfile.TemporaryDirectory()
+        db_path = os.path.join(workdir.name, "bench.db")
+
+    db = Database(db_path, pool_size=args.pool_size)
+    resource_ids = [1] + [db.add_resource(f"Provider {i}") for i in range(2, args.resources + 1)]
+    appointment_tools = AppointmentTools(db, slots=generate_slots(args.days), resource_ids=resource_ids)
+    user_ids = [row.lastrowid for row in (
+        db.execute('''INSERT INTO users (name, email, phone_number, age, appointment_status)
+                      VALUES (?, ?, ?, ?, ?)''',
+                   (f"User {i}", f"user{i}@example.com", f"{i:010d}", 30, 'available'))
+        for i in range(args.conversations)
+    )]
+    conversations = [Conversation(i, user_ids[i], args.seed, args.change_rate, args.cancel_rate)
+                     for i in range(args.conversations)]
+
+    model = ScriptedModel(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000, seed=args.seed)
+    router = IntentRouter() if args.router else None
+    recorder = Recorder()
+
+    if args.metrics or args.trace:
+        tracer.configure(enabled=True, trace_path=args.trace)
+
+    start = time.perf_counter()
+    if args.mode == "async":
+        chatbot = recorder.timed(AsyncChatbot("", "fake-model", [], db, appointment_tools, router=router,
+                                              client=FakeAsyncAnthropic(model)))
+
+        async def main():
+            semaphore = asyncio.Semaphore(args.concurrency)
+            await asyncio.gather(*(run_conversation_async(chatbot, conversation, recorder, semaphore)
+                                   for conversation in conversations))
+
+        asyncio.run(main())
+    else:
+        chatbot = recorder.timed(Chatbot("", "fake-model", [], db, appointment_tools, router=router,
+                                         client=FakeAnthropic(model)))
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(lambda conversation: run_conversation(chatbot, conversation, recorder), conversations))
+    elapsed = time.perf_counter() - start
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "config": vars(args),
+        "elapsed_s": elapsed,
+        "turns": len(recorder.turns),
+        "turns_per_second": len(recorder.turns) / elapsed if elapsed else 0.0,
+        "model_calls": model.calls,
+        "turn_latency": summarize(recorder.turns),
+        "tool_latency": {name: summarize(values) for name, values in sorted(recorder.tools.items())},
+        "bookings": db.fetchone('''SELECT COUNT(*) FROM bookings''')[0],
+        "violations": check_bookings(db),
+        "cache": appointment_tools.cache.stats(),
+        "usage": chatbot.cache_stats(),
+    }
+    db.close()
+    if args.metrics:
+        with open(args.metrics, "w") as f:
+            f.write(tracer.to_prometheus())
+    if workdir is not None:
+        workdir.cleanup()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--conversations", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mode", choices=("threads", "async"), default="threads")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated model latency per call")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="extra uniform random latency per call")
+    parser.add_argument("--days", type=int, default=30, help="days of slots in the calendar")
+    parser.add_argument("--resources", type=int, default=1, help="providers sharing the calendar")
+    parser.add_argument("--change-rate", type=float, default=0.3)
+    parser.add_argument("--cancel-rate", type=float, default=0.2)
+    parser.add_argument("--pool-size", type=int, default=8)
+    parser.add_argument("--router", action="store_true", help="enable the IntentRouter fast path")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", help="database file (default: a temporary file)")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--metrics", help="enable tracing and write Prometheus metrics to this file")
+    parser.add_argument("--trace", help="enable tracing and append JSONL spans to this file")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+    return results
+
+
+if __name__ == "__main__":
+    main()
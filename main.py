@@ -1,188 +1,71 @@
+import sqlite3
+import secrets
 import streamlit as st
-from appointment_system import Database, AppointmentTools, Chatbot, validate_user_data
-import json
+from appointment_system import get_app, message_text, validate_user_data
+
+
+# Streamlit re-runs this script on every interaction; the database pool, the
+# slot inventory and the Anthropic client are built once per process instead.
+@st.cache_resource
+def load_app():
+    return get_app()
+
+
+app = load_app()
+db = app.db
+appointment_tools = app.appointment_tools
+chatbot = app.chatbot
+
+# The conversation lives in the session store; only its id is kept in
+# st.session_state, which stays on the server. The id is a random token issued
+# here and never put in the URL, so a shared link cannot resume someone else's
+# conversation (and book or cancel as them). st.session_state does not survive
+# a reload, a restart or a move to another worker, so once the user is known
+# their latest stored conversation is resumed instead (see resume_session).
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = secrets.token_urlsafe(32)
+# Links from before the id left the URL still carry it; drop it unread.
+if "session" in st.query_params:
+    del st.query_params["session"]
+session = app.sessions.load(st.session_state["session_id"])
+state = session.state
+
+
+def save_session():
+    # A save only fails after losing to other workers' saves several times over.
+    if not app.sessions.save(session):
+        st.warning("This conversation is being changed elsewhere; your latest changes may not have been saved.")
+
+
+def resume_session(user_id):
+    # Signing in as a user with an earlier conversation picks it up again; the
+    # details entered are the same ones that give access to their bookings.
+    global session, state
+    previous = app.sessions.latest(user_id)
+    if previous is not None:
+        app.sessions.delete(session.session_id)
+        st.session_state["session_id"] = previous
+        session = app.sessions.load(previous)
+        state = session.state
+    session.user_id = user_id
+    state["form_submitted"] = True
 
-# Initialize components
-db = Database()
-appointment_tools = AppointmentTools(db)
-
-tools = [
-    {
-        "name": "select_appointment_date",
-        "description": "Lets the user select a date for the appointment.",
-        "input_schema": {
-            "type": "object",
-            "properties": {
-
-            }
-        }
-    },
-    {
-        "name": "select_time_slot",
-        "description": "Lets the user select a time slot from available options for the chosen date.",
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "date": {
-                    "type": "string",
-                    "description": "The selected appointment date."
-                },
-                "available_time_slots": {
-                    "type": "array",
-                    "items": {"type": "string"},
-                    "description": "Available time slots for the selected date."
-                }
-            }
-        }
-    },    {
-        "name": "create_booking",
-        "description": "Create a booking for a specific date and time",
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "date": {
-                    "type": "string",
-                    "description": "The date for the booking (format: YYYY-MM-DD)",
-                },
-                "time": {
-                    "type": "string",
-                    "description": "The time for the booking (format: HH:MM)",
-                },
-            },
-            "required": ["date", "time"],
-        },
-    },
-    {
-        "name": "cancel_booking",
-        "description": "Cancel a booking using the booking ID",
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "booking_id": {
-                    "type": "integer",
-                    "description": "The ID of the booking to be cancelled",
-                },
-            },
-            "required": ["booking_id"],
-        },
-    },
-    {
-        "name": "confirm_booking",
-        "description": "Confirm a booking after creating it",
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "booking_id": {
-                    "type": "integer",
-                    "description": "The ID of the booking to be confirmed",
-                },
-                "date": {
-                    "type": "string",
-                    "description": "The date for the booking (format: YYYY-MM-DD)",
-                },
-                "time": {
-                    "type": "string",
-                    "description": "The time for the booking (format: HH:MM)",
-                },
-            },
-            "required": ["booking_id", "date", "time"],
-        },
-    },
-    {
-        "name": "lookup_user",
-        "description": "Lookup a user based on provided details",
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "name": {
-                    "type": "string",
-                    "description": "The name of the user",
-                },
-                "email": {
-                    "type": "string",
-                    "description": "The email of the user",
-                },
-                "phone_number": {
-                    "type": "string",
-                    "description": "The phone number of the user",
-                },
-            },
-            "required": ["name", "email", "phone_number"],
-        },
-    },
-    {
-        "name": "change_booking_date",
-        "description": "Change the date of an existing booking",
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "booking_id": {
-                    "type": "integer",
-                    "description": "The ID of the booking to be changed",
-                },
-                "new_date": {
-                    "type": "string",
-                    "description": "The new date for the booking (format: YYYY-MM-DD)",
-                },
-            },
-            "required": ["booking_id", "new_date"],
-        },
-    },
-    {
-        "name": "change_booking_time",
-        "description": "Change the time of an existing booking",
-        "input_schema": {
-            "type": "object",
-            "properties": {
-                "booking_id": {
-                    "type": "integer",
-                    "description": "The ID of the booking to be changed",
-                },
-                "new_time": {
-                    "type": "string",
-                    "description": "The new time for the booking (format: HH:MM)",
-                },
-            },
-            "required": ["booking_id", "new_time"],
-        },
-    }
-]
-
-
-chatbot = Chatbot(
-    api_key="",
-    model_name="claude-3-5-sonnet-20240620",
-    tools=tools,
-    db=db,
-    appointment_tools=appointment_tools
-)
 
 # Streamlit UI
 st.title("Appointment Booking Chatbot")
 
-if "user_id" not in st.session_state:
-    st.session_state["user_id"] = None
-
-if "messages" not in st.session_state:
-    st.session_state["messages"] = []
-
-if "conversation_started" not in st.session_state:
-    st.session_state["conversation_started"] = False
-
-if "form_submitted" not in st.session_state:
-    st.session_state["form_submitted"] = False
-
-if "user_data" not in st.session_state:
-    st.session_state["user_data"] = {"name": "", "email": "", "phone_number": "", "age": 18}
+state.setdefault("conversation_started", False)
+state.setdefault("form_submitted", False)
+state.setdefault("user_data", {"name": "", "email": "", "phone_number": "", "age": 18})
 
 # Collect user data
-if st.session_state["user_id"] is None and not st.session_state["form_submitted"]:
+if session.user_id is None and not state["form_submitted"]:
     with st.form(key='user_form'):
         st.subheader("Please enter your details to start:")
-        name = st.text_input("Name", value=st.session_state["user_data"]["name"])
-        email = st.text_input("Email", value=st.session_state["user_data"]["email"])
-        phone_number = st.text_input("Phone Number", value=st.session_state["user_data"]["phone_number"])
-        age = st.number_input("Age", min_value=1, max_value=99, value=st.session_state["user_data"]["age"])
+        name = st.text_input("Name", value=state["user_data"]["name"])
+        email = st.text_input("Email", value=state["user_data"]["email"])
+        phone_number = st.text_input("Phone Number", value=state["user_data"]["phone_number"])
+        age = st.number_input("Age", min_value=1, max_value=99, value=state["user_data"]["age"])
         submit_button = st.form_submit_button("Submit")
 
         if submit_button:
@@ -199,48 +82,71 @@ if st.session_state["user_id"] is None and not st.session_state["form_submitted"
                 # Update session state with valid inputs
                 for field in user_data:
                     if field not in errors:
-                        st.session_state["user_data"][field] = user_data[field]
+                        state["user_data"][field] = user_data[field]
             else:
-                user_id_result = json.loads(appointment_tools.lookup_user(name, email, phone_number))
+                user_id = None
+                user_id_result = appointment_tools.lookup_user(name, email, phone_number)
                 if user_id_result['status'] == 'success':
-                    st.session_state["user_id"] = user_id_result['user_id']
-                    st.success(f"User found with user_id {st.session_state['user_id']}.")
+                    user_id = user_id_result['user_id']
+                    st.success(f"User found with user_id {user_id}.")
                 else:
-                    db.execute('''INSERT INTO users (name, email, phone_number, age, appointment_status)
-                                VALUES (?, ?, ?, ?, ?)''', 
-                            (name, email, phone_number, age, 'available'))
-                    db.commit()
-                    st.session_state["user_id"] = db.cursor.lastrowid
-                    st.success(f"User {name} successfully registered with user_id {st.session_state['user_id']}.")
-                st.session_state["form_submitted"] = True
-                st.rerun()
+                    try:
+                        result = db.execute('''INSERT INTO users (name, email, phone_number, age, appointment_status)
+                                    VALUES (?, ?, ?, ?, ?)''', 
+                                (name, email, phone_number, age, 'available'))
+                    except sqlite3.IntegrityError:
+                        # (email, phone_number) is unique; the details match another user's.
+                        st.error("This email and phone number are already registered under a different name.")
+                    else:
+                        user_id = result.lastrowid
+                        st.success(f"User {name} successfully registered with user_id {user_id}.")
+                if user_id is not None:
+                    resume_session(user_id)
+                    save_session()
+                    st.rerun()
 
 # Display chat history and chatbot UI
-if st.session_state["user_id"] is not None and st.session_state["form_submitted"]:
+if session.user_id is not None and state["form_submitted"]:
     # Clear the screen and display chatbot in full screen
     st.empty()
     
-    # Display chat history
-    for message in st.session_state["messages"]:
-        with st.chat_message(message["role"]):
-            st.markdown(message["content"])
-
-    if not st.session_state["conversation_started"]:
+    # Display chat history. Tool calls and their results are stored as content
+    # blocks; only their text is replayed, and the assistant's text from one
+    # turn goes in one bubble, as it was streamed.
+    history = []
+    for message in session.messages:
+        text = message_text(message["content"])
+        if not text:
+            continue
+        if history and message["role"] == "assistant" and history[-1][0] == "assistant":
+            history[-1][1].append(text)
+        else:
+            history.append((message["role"], [text]))
+    for role, texts in history:
+        with st.chat_message(role):
+            st.markdown("\n\n".join(texts))
+
+    if not state["conversation_started"]:
         with st.chat_message("assistant"):
             st.markdown("Hello, welcome to the appointment booking system! How can I assist you today?")
-        st.session_state["conversation_started"] = True
+        state["conversation_started"] = True
     
     if prompt := st.chat_input("You:"):
-        st.session_state["messages"].append({"role": "user", "content": prompt})
+        session.messages.append({"role": "user", "content": prompt})
         with st.chat_message("user"):
             st.markdown(prompt)
 
-        response = chatbot.chat(prompt, st.session_state["user_id"], st.session_state["messages"])
         with st.chat_message("assistant"):
             try:
-                st.markdown(response)
+                st.write_stream(chatbot.chat_stream(prompt, session.user_id, session.messages))
             except Exception as e:
+                # No rerun, which would clear the error. The turn gets an answer
+                # in the history too, so a replay shows why it went unanswered
+                # and the next request still alternates user and assistant.
+                session.messages.append({"role": "assistant",
+                                         "content": "Sorry, something went wrong there. Please try again."})
                 st.error(f"An error occurred: {str(e)}")
-                st.rerun()
 else:
     st.info("Please fill out your details to start using the chatbot.")
+
+save_session()
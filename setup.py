@@ -3,7 +3,7 @@ from setuptools import setup, find_packages
 setup(
     name="appointment_booking_project",
     version="0.1",
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks", "benchmarks.*"]),
     install_requires=[
         "streamlit",
         "anthropic"
@@ -11,6 +11,7 @@ setup(
     entry_points={
         "console_scripts": [
             "run-app = main",
+            "appointment-bulk = appointment_system.bulk:main",
         ],
     },
 )
@@ -0,0 +1,118 @@
+import random
+import threading
+
+import pytest
+
+from appointment_system import AppointmentTools, Database
+
+SLOTS = {
+    "2024-08-30": ["09:00", "10:00", "11:00"],
+    "2024-08-31": ["09:00", "10:00", "11:00"],
+}
+
+
+@pytest.fixture
+def workers(tmp_path):
+    # Two pools on one file stand in for two processes sharing the database.
+    path = str(tmp_path / "appointments.db")
+    dbs = [Database(path, pool_size=4) for _ in range(2)]
+    tools = [AppointmentTools(db, slots=SLOTS) for db in dbs]
+    dbs[0].execute('''INSERT INTO users (name, email, phone_number, age, appointment_status)
+                      VALUES ('Test User', 'test@example.com', '0123456789', 30, 'available')''')
+    yield dbs, tools
+    for appointment_tools in tools:
+        appointment_tools.reaper.stop()
+    for db in dbs:
+        db.close()
+
+
+def assert_consistent(db):
+    doubles = db.fetchall('''SELECT resource_id, date, time, COUNT(*) FROM bookings
+                             GROUP BY resource_id, date, time HAVING COUNT(*) > 1''')
+    assert doubles == []
+    # A slot is taken exactly when a booking points at it.
+    mismatched = db.fetchall('''SELECT s.resource_id, s.date, s.time, s.available FROM slots s
+                                WHERE s.available = EXISTS (SELECT 1 FROM bookings b WHERE b.resource_id = s.resource_id
+                                                            AND b.date = s.date AND b.time = s.time)''')
+    assert mismatched == []
+
+
+def test_moved_booking_holds_its_new_slot(workers):
+    (db, _), (tools, _) = workers
+    booking_id = tools.create_booking("2024-08-30", "09:00", 1)["booking_id"]
+    assert tools.change_booking_date(booking_id, "2024-08-31").ok
+    assert not tools.create_booking("2024-08-31", "09:00", 1).ok
+    assert tools.create_booking("2024-08-30", "09:00", 1).ok
+    assert_consistent(db)
+
+
+def test_no_double_bookings_under_contention(workers):
+    dbs, tools = workers
+    slots = [(date, time) for date, times in SLOTS.items() for time in times]
+    start = threading.Barrier(16)
+    errors = []
+
+    def worker(seed):
+        rng = random.Random(seed)
+        appointment_tools = tools[seed % len(tools)]
+        start.wait()
+        try:
+            for _ in range(100):
+                date, time = rng.choice(slots)
+                action = rng.random()
+                if action < 0.4:
+                    appointment_tools.create_booking(date, time, 1)
+                elif action < 0.7:
+                    appointment_tools.change_booking_time(rng.randint(1, 20), time)
+                else:
+                    appointment_tools.change_booking_date(rng.randint(1, 20), date, time)
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert dbs[0].fetchone('''SELECT COUNT(*) FROM bookings''')[0] > 0
+    assert_consistent(dbs[0])
+
+
+def test_slots_added_under_existing_bookings_start_taken(tmp_path):
+    path = str(tmp_path / "appointments.db")
+    db = Database(path)
+    db.execute('''INSERT INTO bookings (user_id, date, time, status) VALUES (1, '2024-08-30', '09:00', 'confirmed')''')
+    tools = AppointmentTools(db, slots=SLOTS)
+    assert not tools.create_booking("2024-08-30", "09:00", 2).ok
+    assert_consistent(db)
+    tools.reaper.stop()
+
+    # Databases that already have such a slot are repaired when they upgrade.
+    db.execute('''UPDATE slots SET available=1''')
+    db.execute('''PRAGMA user_version = 5''')
+    db.close()
+    db = Database(path)
+    assert_consistent(db)
+    db.close()
+
+
+def test_holds_left_by_another_process_are_reaped_on_start(tmp_path):
+    path = str(tmp_path / "appointments.db")
+    db = Database(path)
+    tools = AppointmentTools(db, slots=SLOTS)
+    db.execute('''INSERT INTO users (name, email, phone_number, age, appointment_status)
+                  VALUES ('Test User', 'test@example.com', '0123456789', 30, 'available')''')
+    assert tools.create_booking("2024-08-30", "09:00", 1).ok
+    tools.reaper.stop()
+    db.execute('''UPDATE bookings SET expires_at = 0''')
+    db.close()
+
+    # A new process that never creates a hold of its own still frees it.
+    db = Database(path)
+    tools = AppointmentTools(db)
+    tools.reaper.stop()
+    assert db.fetchall('''SELECT * FROM bookings''') == []
+    assert_consistent(db)
+    db.close()
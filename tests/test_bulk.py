@@ -0,0 +1,40 @@
+from appointment_system import Database, bulk
+
+
+def test_bad_jsonl_rows_are_reported_not_fatal(tmp_path):
+    db = Database(str(tmp_path / "appointments.db"))
+    path = tmp_path / "users.jsonl"
+    path.write_text(
+        '{"user_id": 1, "name": "Ann Lee", "email": "ann@example.com", "phone_number": 5551234567, "age": 30}\n'
+        '{not json\n'
+        '[1, 2]\n'
+        '{"user_id": [3], "name": true, "email": 5, "phone_number": null, "age": [1]}\n'
+    )
+    report = bulk.import_users(db, path)
+    assert (report.rows, report.imported, report.invalid) == (4, 1, 3)
+    assert [line for line, _ in report.errors] == [2, 3, 4]
+    assert db.fetchone('''SELECT phone_number FROM users WHERE user_id=1''') == ("5551234567",)
+    db.close()
+
+
+def test_main_exits_cleanly(tmp_path, capsys):
+    db_path = str(tmp_path / "appointments.db")
+    Database(db_path).close()
+    assert bulk.main(["export", "users", str(tmp_path / "users.csv"), "--db", db_path]) is None
+
+
+def test_bookings_for_unknown_resources_are_rejected(tmp_path):
+    db = Database(str(tmp_path / "appointments.db"))
+    db.execute('''INSERT INTO users (user_id, name, email, phone_number, age, appointment_status)
+                  VALUES (1, 'Ann Lee', 'ann@example.com', '5551234567', 30, 'available')''')
+    path = tmp_path / "bookings.jsonl"
+    path.write_text(
+        '{"user_id": 1, "resource_id": -1, "date": "2024-08-30", "time": "09:00"}\n'
+        '{"user_id": 1, "resource_id": 100000, "date": "2024-08-30", "time": "09:00"}\n'
+        '{"user_id": 1, "resource_id": 1, "date": "2024-08-30", "time": "09:00"}\n'
+    )
+    report = bulk.import_bookings(db, path)
+    assert (report.imported, report.invalid) == (1, 2)
+    assert [list(errors) for _, errors in report.errors] == [["resource_id"], ["resource_id"]]
+    assert db.fetchall('''SELECT DISTINCT resource_id FROM slots''') == [(1,)]
+    db.close()
@@ -0,0 +1,31 @@
+import pytest
+
+from appointment_system import RateLimiter
+
+
+class Overloaded(Exception):
+    status_code = 529
+    response = None
+
+
+class Response:
+    usage = None
+
+
+def test_failed_attempts_do_not_keep_their_token_reservation():
+    # A frozen clock, so only reservations and refunds move the bucket.
+    limiter = RateLimiter(tokens_per_minute=10_000, max_retries=3, base_delay=0.0, clock=lambda: 0.0, seed=0)
+    attempts = []
+
+    def call():
+        attempts.append(1)
+        if len(attempts) < 4:
+            raise Overloaded()
+        return Response()
+
+    limiter.call(call, 5_000)
+    assert limiter.tokens.level == 5_000
+
+    with pytest.raises(Overloaded):
+        limiter.call(lambda: (_ for _ in ()).throw(Overloaded()), 1_000)
+    assert limiter.tokens.level == 5_000
@@ -0,0 +1,38 @@
+import datetime
+
+from appointment_system import AppointmentTools, Database, DEFAULT_RULES
+
+
+def next_weekday():
+    date = datetime.date.today()
+    while date.weekday() > 4:
+        date += datetime.timedelta(days=1)
+    return date.isoformat()
+
+
+def test_resources_get_rule_slots_on_materialized_days_and_after_restart(tmp_path):
+    db = Database(str(tmp_path / "appointments.db"))
+    tools = AppointmentTools(db, rules=DEFAULT_RULES)
+    day = next_weekday()
+    assert tools.select_time_slot(day).ok
+    resource_id = tools.add_resource("Dr B")
+    assert tools.select_time_slot(day, resource_id)["available_time_slots"]
+    tools.reaper.stop()
+
+    restarted = AppointmentTools(db, rules=DEFAULT_RULES)
+    later = (datetime.date.fromisoformat(day) + datetime.timedelta(days=7)).isoformat()
+    assert restarted.create_booking(later, "09:00", 1, resource_id)["resource_id"] == resource_id
+    restarted.reaper.stop()
+    db.close()
+
+
+def test_dates_outside_the_booking_window_are_refused(tmp_path):
+    db = Database(str(tmp_path / "appointments.db"))
+    tools = AppointmentTools(db, rules=DEFAULT_RULES)
+    too_late = datetime.date.today() + datetime.timedelta(days=DEFAULT_RULES.horizon_days)
+    assert not tools.create_booking("2001-01-02", "09:00", 1).ok
+    assert not tools.select_time_slot(too_late.isoformat()).ok
+    assert not tools.select_time_slot("2999-01-01").ok
+    assert db.fetchone('''SELECT COUNT(*) FROM slots''') == (0,)
+    tools.reaper.stop()
+    db.close()
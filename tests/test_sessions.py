@@ -0,0 +1,68 @@
+import threading
+
+from appointment_system import Database, SQLiteSessionStore
+
+
+def test_concurrent_saves_keep_both_workers_changes(tmp_path):
+    db = Database(str(tmp_path / "appointments.db"))
+    first, second = SQLiteSessionStore(db), SQLiteSessionStore(db)
+    session = first.load("s")
+    session.user_id = 1
+    session.state["kept"] = True
+    session.messages.append({"role": "user", "content": "hello"})
+    assert first.save(session)
+
+    ours, theirs = first.load("s"), second.load("s")
+    theirs.messages.append({"role": "user", "content": "from second"})
+    theirs.state["second"] = 2
+    assert second.save(theirs)
+    ours.messages.append({"role": "user", "content": "from first"})
+    ours.state["first"] = 1
+    assert first.save(ours)
+
+    stored = SQLiteSessionStore(db).load("s")
+    assert [message["content"] for message in stored.messages] == ["hello", "from second", "from first"]
+    assert stored.state == {"kept": True, "first": 1, "second": 2}
+    assert stored.user_id == 1
+    db.close()
+
+
+def test_racing_saves_store_each_saved_message_once(tmp_path):
+    db = Database(str(tmp_path / "appointments.db"), pool_size=8)
+    start = threading.Barrier(8)
+    saved = []
+
+    def worker(n):
+        store = SQLiteSessionStore(db)
+        start.wait()
+        for i in range(10):
+            session = store.load("s")
+            session.messages.append({"role": "user", "content": f"{n}-{i}"})
+            if store.save(session):
+                saved.append(f"{n}-{i}")
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # A save may give up after losing repeatedly; what it reported saved must
+    # be there, and nothing may be stored twice.
+    contents = [message["content"] for message in SQLiteSessionStore(db).load("s").messages]
+    assert len(contents) == len(set(contents))
+    assert set(saved) <= set(contents)
+    assert len(saved) > 40
+    db.close()
+
+
+def test_latest_finds_the_users_most_recent_session(tmp_path):
+    db = Database(str(tmp_path / "appointments.db"))
+    store = SQLiteSessionStore(db)
+    for session_id, user_id in (("old", 1), ("other", 2), ("new", 1)):
+        session = store.load(session_id)
+        session.user_id = user_id
+        assert store.save(session)
+    assert store.latest(1) == "new"
+    assert store.latest(3) is None
+    db.close()
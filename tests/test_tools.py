@@ -0,0 +1,85 @@
+import json
+from types import SimpleNamespace
+
+from appointment_system import TOOLS, AppointmentTools, Chatbot, ConversationMemory, Database, IntentRouter, message_text
+from benchmarks.fake_client import Block, Message, Usage
+
+
+def test_unknown_resource_ids_are_rejected_before_use(tmp_path):
+    db = Database(str(tmp_path / "appointments.db"))
+    tools = AppointmentTools(db)
+    for resource_id in (-1, "2", 10 ** 9, True, 1.0):
+        for result in (tools.select_time_slot("2024-08-30", resource_id),
+                       tools.select_appointment_date(resource_id),
+                       tools.next_available_slots("2024-08-30 00:00", resource_id=resource_id),
+                       tools.create_booking("2024-08-30", "09:00", 1, resource_id)):
+            assert result["message"].startswith("Unknown provider")
+    assert tools.cache.stats()["size"] == 0
+    assert tools.select_time_slot("2024-08-30", 1).ok
+    tools.reaper.stop()
+    db.close()
+
+
+def test_unknown_tool_is_reported_as_an_error(tmp_path):
+    db = Database(str(tmp_path / "appointments.db"))
+    tools = AppointmentTools(db)
+    chatbot = Chatbot("", "model", TOOLS, db, tools, client=object())
+    result = chatbot._run_tool(SimpleNamespace(name="no_such_tool", input={}, id="toolu_1"), 1)
+    assert result["is_error"] is True
+    assert json.loads(result["content"]) == {"status": "error", "message": "Unknown tool no_such_tool"}
+    assert chatbot._run_tool(SimpleNamespace(name="list_resources", input={}, id="toolu_2"), 1)["is_error"] is False
+    tools.reaper.stop()
+    db.close()
+
+
+def test_routed_cancel_only_touches_the_callers_bookings(tmp_path):
+    db = Database(str(tmp_path / "appointments.db"))
+    tools = AppointmentTools(db)
+    for email in ("ann@example.com", "bob@example.com"):
+        db.execute('''INSERT INTO users (name, email, phone_number, age, appointment_status)
+                      VALUES ('Test User', ?, '0123456789', 30, 'available')''', (email,))
+    booking_id = tools.create_booking("2024-08-30", "09:00", 1)["booking_id"]
+    assert tools.confirm_booking(booking_id, "2024-08-30", "09:00").ok
+    chatbot = Chatbot("", "model", TOOLS, db, tools, router=IntentRouter(), client=object())
+
+    assert chatbot._route(f"cancel booking {booking_id}", 2, []).startswith("I couldn't cancel")
+    assert db.fetchone('''SELECT COUNT(*) FROM bookings''') == (1,)
+    assert chatbot._route(f"cancel booking {booking_id}", 1, []) == f"Booking {booking_id} has been cancelled."
+    assert db.fetchone('''SELECT COUNT(*) FROM bookings''') == (0,)
+    tools.reaper.stop()
+    db.close()
+
+
+class _Stream:
+    def __init__(self, message):
+        self.message = message
+        self.text_stream = [block.text for block in message.content if block.type == "text"]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def get_final_message(self):
+        return self.message
+
+
+def test_text_from_successive_model_calls_is_separated(tmp_path):
+    db = Database(str(tmp_path / "appointments.db"))
+    tools = AppointmentTools(db)
+    replies = iter([
+        Message([Block(type="text", text="Let me check."),
+                 Block(type="tool_use", id="toolu_1", name="list_resources", input={})], "tool_use", Usage(1, 1)),
+        Message([Block(type="text", text="There is one provider.")], "end_turn", Usage(1, 1)),
+    ])
+    client = SimpleNamespace(messages=SimpleNamespace(stream=lambda **request: _Stream(next(replies))))
+    chatbot = Chatbot("", "model", TOOLS, db, tools, client=client)
+    messages = ConversationMemory([{"role": "user", "content": "Who can I see?"}])
+
+    assert "".join(chatbot.chat_stream("Who can I see?", 1, messages)) == "Let me check.\n\nThere is one provider."
+    # The text said before the tool call is kept for the replayed history.
+    assert [message_text(message["content"]) for message in messages] == [
+        "Who can I see?", "Let me check.", "", "There is one provider."]
+    tools.reaper.stop()
+    db.close()